@@ -4,3 +4,10 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.conf import settings
+        from api.auth import get_public_key
+
+        ## parse the JWT public key at startup, a bad key fails here instead of on every request
+        get_public_key(settings.JWT_PUB_KEY)
@@ -1,10 +1,97 @@
 import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 
 from rest_framework import authentication, permissions
 from rest_framework import exceptions
 from django.conf import settings
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
 import jwt
 
+AUTH_HEADER = re.compile("^(?P<type>Bearer|JWT)\s(?P<token>.+)$")
+
+class VerifiedTokenCache(object):
+    """Bounded LRU of tokens that passed verification, keyed by a digest of the
+    token and the public key it was verified with. An entry lasts `ttl` seconds, or until the token's `exp` if sooner.
+    Tokens that fail verification are never cached."""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, token, public_key):
+        ## a token verified with a key that has since been replaced must be checked again
+        return hashlib.sha256(public_key.encode('utf-8') + b'\0' + token.encode('utf-8')).digest()
+
+    def get(self, token, public_key=''):
+        key = self.key(token, public_key)
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry == None:
+                return None
+
+            payload, expires_at = entry
+            if expires_at <= now:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return payload
+
+    def set(self, token, payload, public_key=''):
+        expires_at = time.time() + self.ttl
+        if 'exp' in payload:
+            try:
+                expires_at = min(expires_at, int(payload['exp']))
+            except (TypeError, ValueError):
+                return
+
+        key = self.key(token, public_key)
+
+        with self.lock:
+            self.entries[key] = (payload, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+token_cache = VerifiedTokenCache(getattr(settings, 'JWT_CACHE_SIZE', 1024),
+                                 getattr(settings, 'JWT_CACHE_TTL', 300))
+
+_public_keys = {}
+
+def get_public_key(pem):
+    """Parses a PEM public key once, instead of on every jwt.decode"""
+    if pem not in _public_keys:
+        _public_keys[pem] = load_pem_public_key(pem.strip().encode('utf-8'), backend=default_backend())
+    return _public_keys[pem]
+
+def verify_token(token):
+    """Returns the token's payload if it has a valid signature, and `exp` and
+    `nbf` allow it to be used now. Otherwise None."""
+    payload = token_cache.get(token, settings.JWT_PUB_KEY)
+    if payload != None:
+        return payload
+
+    try:
+        payload = jwt.decode(token, get_public_key(settings.JWT_PUB_KEY), algorithms=["RS256"])
+    except:
+        return None
+
+    token_cache.set(token, payload, settings.JWT_PUB_KEY)
+
+    return payload
+
 class CognomaAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         if 'HTTP_AUTHORIZATION' not in request.META:
@@ -15,7 +102,7 @@ class CognomaAuthentication(authentication.BaseAuthentication):
         if not auth_header:
             return None
 
-        match = re.match("^(?P<type>Bearer|JWT)\s(?P<token>.+)$", auth_header)
+        match = AUTH_HEADER.match(auth_header)
 
         if not match:
             return None
@@ -24,12 +111,9 @@ class CognomaAuthentication(authentication.BaseAuthentication):
         token = match.group('token')
 
         if auth_type == 'JWT':
-            try:
-                payload = jwt.decode(token, settings.JWT_PUB_KEY, algorithms=["RS256"])
-            except:
-                return None
+            payload = verify_token(token)
 
-            if 'service' not in payload:
+            if payload == None or 'service' not in payload:
                 return None
 
             service = payload['service']
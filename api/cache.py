@@ -0,0 +1,107 @@
+import os
+import threading
+
+import psycopg2
+from django.conf import settings
+from django.db import connection
+
+from api.models import TaskDef
+
+CHANGED_CHANNEL = 'task_defs_changed'
+
+class TaskDefCache(object):
+    """Process local cache of task defs.
+
+    Each process holds its own connection LISTENing for `task_defs_changed`,
+    which a trigger on task_defs sends on commit (migration 0011). Checking
+    for a notification reads the socket without a round trip, so a cache hit
+    runs no query. The cache is dropped whenever a notification arrives, or
+    the listening connection is lost.
+
+    Task defs read inside a transaction aren't cached, they may not be
+    committed. Cached instances are shared, don't modify them.
+    """
+
+    def __init__(self):
+        self.task_defs = {}
+        self.listener = None
+        self.pid = None
+        self.lock = threading.RLock()
+
+    def get(self, name):
+        """The TaskDef named `name`, or None if there isn't one"""
+        return self.get_many([name]).get(name, None)
+
+    def get_many(self, names):
+        """Dict of name to TaskDef, for the `names` that exist"""
+        with self.lock:
+            cacheable = self.poll() and not connection.in_atomic_block
+
+            found = {}
+            missing = []
+            for name in names:
+                if name in self.task_defs:
+                    found[name] = self.task_defs[name]
+                else:
+                    missing.append(name)
+
+            if missing:
+                for task_def in TaskDef.objects.filter(name__in=missing):
+                    found[task_def.name] = task_def
+                    if cacheable:
+                        self.task_defs[task_def.name] = task_def
+
+            return found
+
+    def clear(self):
+        with self.lock:
+            self.task_defs = {}
+
+    def poll(self):
+        """Drops the cache if task defs changed. Returns False if changes can't be
+        heard, in which case nothing should be cached."""
+        if not getattr(settings, 'TASK_DEF_CACHE', True):
+            return False
+
+        if self.listener is None or self.pid != os.getpid():
+            return self.listen()
+
+        try:
+            self.listener.poll()
+        except psycopg2.Error:
+            self.close()
+            return self.listen()
+
+        if self.listener.notifies:
+            del self.listener.notifies[:]
+            self.clear()
+
+        return True
+
+    def listen(self):
+        ## anything cached before LISTEN may have missed a change
+        self.clear()
+        self.listener = None
+        self.pid = os.getpid()
+
+        try:
+            listener = psycopg2.connect(**connection.get_connection_params())
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute('LISTEN ' + CHANGED_CHANNEL)
+        except psycopg2.Error:
+            return False
+
+        self.listener = listener
+        return True
+
+    def close(self):
+        if self.listener is not None and self.pid == os.getpid():
+            try:
+                self.listener.close()
+            except psycopg2.Error:
+                pass
+        self.listener = None
+        self.clear()
+
+task_defs = TaskDefCache()
@@ -0,0 +1,83 @@
+"""Encoders for task and task def rows, for the queue and list endpoints.
+
+They give the same representation as TaskSerializer and TaskDefSerializer,
+but read dict rows (from `queue.dictfetchall` or `QuerySet.values()`) without
+building a model instance or going through DRF's per field objects. Only
+datetimes need converting, every other column is already in its output type.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+
+def iso_8601(value):
+    """DRF's DateTimeField `iso-8601` format, UTC as `Z`"""
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+def row_encoder(fields):
+    """Builds an encoder from a sequence of (output name, row key, convert).
+    `convert` is skipped for None, like Serializer.to_representation."""
+    fields = tuple(fields)
+
+    def encode(row):
+        encoded = OrderedDict()
+        for name, key, convert in fields:
+            value = row[key]
+            if convert is not None and value is not None:
+                value = convert(value)
+            encoded[name] = value
+        return encoded
+
+    return encode
+
+def task_fields(task_def_key):
+    """TaskSerializer's fields, in order. Rows from raw SQL have the task def
+    under its column name, `task_def_name`, QuerySet.values() uses `task_def_id`."""
+    return (('id', 'id', None),
+            ('task_def', task_def_key, None),
+            ('status', 'status', None),
+            ('worker_id', 'worker_id', None),
+            ('locked_at', 'locked_at', iso_8601),
+            ('lease_expires_at', 'lease_expires_at', iso_8601),
+            ('priority', 'priority', None),
+            ('unique', 'unique', None),
+            ('run_at', 'run_at', iso_8601),
+            ('timeout', 'timeout', None),
+            ('started_at', 'started_at', iso_8601),
+            ('completed_at', 'completed_at', iso_8601),
+            ('failed_at', 'failed_at', iso_8601),
+            ('data', 'data', None),
+            ('data_digest', 'data_digest', None),
+            ('attempts', 'attempts', None),
+            ('created_at', 'created_at', iso_8601),
+            ('updated_at', 'updated_at', iso_8601))
+
+TASK_FIELD_NAMES = tuple(name for name, key, convert in task_fields('task_def_name'))
+
+# `names` comes from the client's `fields`, so only the most recent field sets are kept
+@lru_cache(maxsize=64)
+def task_encoder(names, task_def_key):
+    """Encoder for only the task fields in `names`, for sparse fieldsets"""
+    return row_encoder(field for field in task_fields(task_def_key) if field[0] in names)
+
+def task_keys(names, task_def_key):
+    """Row keys the task fields in `names` are read from"""
+    return [key for name, key, convert in task_fields(task_def_key) if name in names]
+
+encode_task_row = task_encoder(TASK_FIELD_NAMES, 'task_def_name')
+encode_task_values = task_encoder(TASK_FIELD_NAMES, 'task_def_id')
+
+encode_task_def_values = row_encoder((('name', 'name', None),
+                                      ('title', 'title', None),
+                                      ('description', 'description', None),
+                                      ('default_timeout', 'default_timeout', None),
+                                      ('max_attempts', 'max_attempts', None),
+                                      ('weight', 'weight', None),
+                                      ('max_concurrency', 'max_concurrency', None),
+                                      ('retry_delay', 'retry_delay', None),
+                                      ('retry_backoff', 'retry_backoff', None),
+                                      ('retry_jitter', 'retry_jitter', None),
+                                      ('retry_max_delay', 'retry_max_delay', None),
+                                      ('created_at', 'created_at', iso_8601),
+                                      ('updated_at', 'updated_at', iso_8601)))
@@ -0,0 +1,97 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+
+from api import transitions, schedules, payloads, metrics
+
+class Command(BaseCommand):
+    help = ('Puts tasks with expired leases and failed tasks with attempts left back in the queue, '
+            'queues the due runs of schedules, promotes scheduled tasks that are coming due '
+            'and deletes task data no task refers to')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between passes. Default 5.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Most tasks updated per statement. Default 1000.')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Run a single pass and exit.')
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help='Serve Prometheus metrics over HTTP on this port. Default off.')
+
+    def handle(self, *args, **options):
+        if options['metrics_port'] != None:
+            ## the maintainer's counters live in this process, not the web servers'
+            metrics.start_http_server(options['metrics_port'])
+
+        while True:
+            started = time.time()
+            try:
+                counts = self.run_pass(options['batch_size'])
+            except DatabaseError as e:
+                if options['once']:
+                    raise
+
+                ## a restart or dropped connection shouldn't stop the daemon,
+                ## the next pass starts on a new connection
+                self.stderr.write('queue_maintainer error={}'.format(repr(str(e).strip())))
+                connection.close()
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write('queue_maintainer reclaimed={reclaimed} requeued={requeued} failed={failed} '
+                              'scheduled={scheduled} promoted={promoted} '
+                              'payloads_deleted={payloads_deleted} duration_ms={duration_ms}'
+                              .format(duration_ms=int((time.time() - started) * 1000), **counts))
+
+            if options['once']:
+                break
+
+            ## don't hold a connection open between passes
+            connection.close()
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
+
+    def run_pass(self, batch_size):
+        """Drains the backlogs in batches, each batch its own short transaction"""
+        counts = {'reclaimed': 0, 'requeued': 0, 'failed': 0,
+                  'scheduled': 0, 'promoted': 0, 'payloads_deleted': 0}
+
+        while True:
+            reclaimed = transitions.reclaim_expired_leases(batch_size)
+            counts['reclaimed'] += reclaimed
+            if reclaimed < batch_size:
+                break
+
+        while True:
+            requeued, failed = transitions.requeue_retries(batch_size)
+            counts['requeued'] += requeued
+            counts['failed'] += failed
+            if requeued + failed < batch_size:
+                break
+
+        while True:
+            scheduled, more = schedules.materialize(batch_size)
+            counts['scheduled'] += scheduled
+            if not more:
+                break
+
+        while True:
+            promoted = transitions.promote_scheduled(batch_size)
+            counts['promoted'] += promoted
+            if promoted < batch_size:
+                break
+
+        while True:
+            deleted = payloads.delete_unreferenced(batch_size)
+            counts['payloads_deleted'] += deleted
+            if deleted < batch_size:
+                break
+
+        metrics.LEASES_RECLAIMED.inc(counts['reclaimed'])
+        metrics.RETRIES.labels('requeued').inc(counts['requeued'])
+        metrics.RETRIES.labels('failed').inc(counts['failed'])
+        metrics.SCHEDULED.inc(counts['scheduled'])
+        metrics.PROMOTED.inc(counts['promoted'])
+
+        return counts
@@ -0,0 +1,87 @@
+import os
+from contextlib import contextmanager
+
+import prometheus_client
+from prometheus_client import (Counter, Histogram, CollectorRegistry, REGISTRY, multiprocess,
+                               generate_latest, CONTENT_TYPE_LATEST)
+from rest_framework import exceptions
+
+# Labels are limited to values from a small fixed set, or registered task defs.
+# Worker ids are chosen by workers, so they are never used as a label.
+
+PULL_SECONDS = Histogram('task_service_pull_duration_seconds',
+                         'Time taken by a queue pull, including any long poll wait',
+                         ['long_poll'])
+PULL_TASKS = Histogram('task_service_pull_tasks',
+                       'Tasks returned per queue pull',
+                       buckets=(0, 1, 2, 3, 5, 10))
+PULLS = Counter('task_service_pulls_total',
+                'Queue pulls, by whether any task was returned',
+                ['result'])
+TASKS_PULLED = Counter('task_service_tasks_pulled_total',
+                       'Tasks issued to workers',
+                       ['task_def'])
+
+REQUEST_SECONDS = Histogram('task_service_request_duration_seconds',
+                            'Time taken by instrumented views, including serialization',
+                            ['view'])
+
+TASK_WRITES = Counter('task_service_task_writes_total',
+                      'Tasks created or updated through the task API, conflicts are `unique` collisions',
+                      ['operation', 'result'])
+
+TASKS_FINISHED = Counter('task_service_tasks_finished_total',
+                         'Tasks completed or failed by workers, by the status they were left in',
+                         ['status'])
+
+TRANSITIONS = Counter('task_service_transitions_total',
+                      'Touch, release and dequeue requests, by result',
+                      ['transition', 'result'])
+
+LEASES_RECLAIMED = Counter('task_service_leases_reclaimed_total',
+                           'In progress tasks put back in the queue after their lease expired')
+RETRIES = Counter('task_service_retries_total',
+                  'Failed - retrying tasks put back in the queue, or failed when out of attempts',
+                  ['result'])
+SCHEDULED = Counter('task_service_scheduled_tasks_total',
+                    'Tasks queued by recurring schedules')
+PROMOTED = Counter('task_service_tasks_promoted_total',
+                   'Scheduled tasks moved into the queue as their run_at came near')
+
+def record_pull(tasks):
+    PULL_TASKS.observe(len(tasks))
+    PULLS.labels('tasks' if tasks else 'empty').inc()
+    for task in tasks:
+        TASKS_PULLED.labels(task['task_def_name']).inc()
+
+@contextmanager
+def transition(name):
+    """Times a task transition view and counts its result"""
+    with REQUEST_SECONDS.labels(name).time():
+        try:
+            yield
+        except exceptions.NotFound:
+            TRANSITIONS.labels(name, 'not_found').inc()
+            raise
+        except exceptions.APIException as exc:
+            TRANSITIONS.labels(name, 'conflict' if exc.status_code == 409 else 'error').inc()
+            raise
+
+    TRANSITIONS.labels(name, 'ok').inc()
+
+def get_registry():
+    """With `prometheus_multiproc_dir` set, every WSGI worker process writes its
+    samples there and a scrape adds them up, whichever process serves it"""
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+
+    return REGISTRY
+
+def render():
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+def start_http_server(port):
+    """Serves this process's metrics at any path on `port`, from a background thread"""
+    prometheus_client.start_http_server(port, registry=get_registry())
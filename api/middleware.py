@@ -0,0 +1,103 @@
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+
+from api import timing
+
+logger = logging.getLogger('api.timing')
+
+class ThresholdGZipMiddleware(GZipMiddleware):
+    """Gzips responses of at least GZIP_MIN_BYTES, for clients that accept it.
+    Smaller responses aren't worth the CPU."""
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.GZIP_MIN_BYTES:
+            return response
+
+        return super(ThresholdGZipMiddleware, self).process_response(request, response)
+
+class RequestTimingMiddleware(object):
+    """Times a sample of requests, REQUEST_TIMING_SAMPLE_RATE of them, when
+    REQUEST_TIMING is on. Each sampled request gets a Server-Timing header and a
+    log line with its wall time, SQL query count and time, the time spent
+    encoding rows (`timing.span('serialize')` in views) and rendering.
+
+    Queries are counted with Django's query log, which is only switched on for
+    sampled requests, so the rest run as they would without the middleware.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'REQUEST_TIMING', False):
+            raise MiddlewareNotUsed()
+
+    def process_request(self, request):
+        timing.local.timer = None
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return
+
+        timer = timing.RequestTimer()
+        for connection in connections.all():
+            timer.query_logs[connection.alias] = (connection.force_debug_cursor, len(connection.queries_log))
+            connection.force_debug_cursor = True
+
+        timing.local.timer = timer
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timer = timing.current()
+        if timer is not None:
+            timer.view = getattr(view_func, '__name__', None)
+
+    def process_template_response(self, request, response):
+        ## DRF responses are rendered after this, before process_response
+        timer = timing.current()
+        if timer is not None:
+            timer.render_start = time.perf_counter()
+        return response
+
+    def process_response(self, request, response):
+        timer = timing.current()
+        if timer is None:
+            return response
+        timing.local.timer = None
+
+        now = time.perf_counter()
+        total = now - timer.start
+        render = None if timer.render_start is None else now - timer.render_start
+
+        queries = 0
+        db = 0.0
+        for connection in connections.all():
+            force_debug_cursor, start = timer.query_logs.get(connection.alias, (False, 0))
+            connection.force_debug_cursor = force_debug_cursor
+            logged = list(connection.queries_log)[start:]
+            queries += len(logged)
+            db += sum(float(query['time']) for query in logged)
+
+        server_timing = ['total;dur={:.1f}'.format(total * 1000),
+                         'db;dur={:.1f};desc="{} queries"'.format(db * 1000, queries)]
+        for name, seconds in timer.spans.items():
+            server_timing.append('{};dur={:.1f}'.format(name, seconds * 1000))
+        if render is not None:
+            server_timing.append('render;dur={:.1f}'.format(render * 1000))
+        response['Server-Timing'] = ', '.join(server_timing)
+
+        fields = [('view', timer.view),
+                  ('method', request.method),
+                  ('path', request.path),
+                  ('status', response.status_code),
+                  ('total_ms', '{:.1f}'.format(total * 1000)),
+                  ('queries', queries),
+                  ('db_ms', '{:.1f}'.format(db * 1000))]
+        fields += [(name + '_ms', '{:.1f}'.format(seconds * 1000)) for name, seconds in timer.spans.items()]
+        if render is not None:
+            fields.append(('render_ms', '{:.1f}'.format(render * 1000)))
+
+        logger.info('request_timing ' + ' '.join('{}={}'.format(key, value) for key, value in fields),
+                    extra=dict(fields))
+
+        return response
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_remove_priority_levels'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='priority_rank',
+            field=models.SmallIntegerField(default=3),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE "tasks" SET "priority_rank" =
+                CASE WHEN "priority" = 'critical' THEN 1
+                     WHEN "priority" = 'high' THEN 2
+                     WHEN "priority" = 'normal' THEN 3
+                     WHEN "priority" = 'low' THEN 4
+                END;
+            """,
+            migrations.RunSQL.noop
+        ),
+        # partial indexes are not currently available within django framework
+        # ready tasks - serves the pull query's per task def ORDER BY without a sort
+        migrations.RunSQL(
+            "CREATE INDEX \"tasks_ready_idx\" ON \"tasks\" (\"task_def_name\", \"priority_rank\", \"run_at\", \"id\") WHERE (\"status\" IN ('queued','failed_retrying'));",
+            "DROP INDEX \"tasks_ready_idx\";"
+        ),
+        # leased tasks - keeps the expired lease lookup off the rest of the table
+        migrations.RunSQL(
+            "CREATE INDEX \"tasks_in_progress_idx\" ON \"tasks\" (\"task_def_name\", \"locked_at\") WHERE (\"status\" = 'in_progress');",
+            "DROP INDEX \"tasks_in_progress_idx\";"
+        )
+    ]
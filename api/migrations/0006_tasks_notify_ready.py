@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_task_priority_rank_ready_index'),
+    ]
+
+    operations = [
+        # wakes long polling pulls - payload is "<task_def_name> <run_at epoch, rounded up>"
+        # identical payloads are folded by postgres, so a bulk insert due in the same second
+        # only sends one notification per task def
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION tasks_notify_ready() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('tasks_ready',
+                                  NEW.task_def_name || ' ' || ceil(extract(epoch from NEW.run_at))::bigint);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER tasks_notify_ready
+                AFTER INSERT OR UPDATE OF status, run_at ON tasks
+                FOR EACH ROW
+                WHEN (NEW.status IN ('queued', 'failed_retrying'))
+                EXECUTE PROCEDURE tasks_notify_ready();
+            """,
+            """
+            DROP TRIGGER tasks_notify_ready ON tasks;
+            DROP FUNCTION tasks_notify_ready();
+            """
+        )
+    ]
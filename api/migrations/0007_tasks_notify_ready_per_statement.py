@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_tasks_notify_ready'),
+    ]
+
+    operations = [
+        # inserts notify once per statement from the transition table, so a bulk insert
+        # doesn't run the trigger function per row. Transition tables can't be used with
+        # a column list, so updates keep the row level trigger.
+        migrations.RunSQL(
+            """
+            DROP TRIGGER tasks_notify_ready ON tasks;
+
+            CREATE FUNCTION tasks_notify_ready_inserted() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('tasks_ready', task_def_name || ' ' || run_at)
+                FROM (SELECT task_def_name, ceil(extract(epoch from run_at))::bigint AS run_at
+                      FROM inserted_tasks
+                      WHERE status IN ('queued', 'failed_retrying')
+                      GROUP BY 1, 2) ready;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER tasks_notify_ready_inserted
+                AFTER INSERT ON tasks
+                REFERENCING NEW TABLE AS inserted_tasks
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE tasks_notify_ready_inserted();
+
+            CREATE TRIGGER tasks_notify_ready
+                AFTER UPDATE OF status, run_at ON tasks
+                FOR EACH ROW
+                WHEN (NEW.status IN ('queued', 'failed_retrying'))
+                EXECUTE PROCEDURE tasks_notify_ready();
+            """,
+            """
+            DROP TRIGGER tasks_notify_ready ON tasks;
+            DROP TRIGGER tasks_notify_ready_inserted ON tasks;
+            DROP FUNCTION tasks_notify_ready_inserted();
+
+            CREATE TRIGGER tasks_notify_ready
+                AFTER INSERT OR UPDATE OF status, run_at ON tasks
+                FOR EACH ROW
+                WHEN (NEW.status IN ('queued', 'failed_retrying'))
+                EXECUTE PROCEDURE tasks_notify_ready();
+            """
+        )
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_tasks_notify_ready_per_statement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='lease_expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='timeout',
+            field=models.IntegerField(null=True),
+        ),
+        # same deadline the pull query used to compute at join time
+        migrations.RunSQL(
+            """
+            UPDATE "tasks" SET "lease_expires_at" = "tasks"."locked_at" + INTERVAL '1 second' * "task_defs"."default_timeout"
+            FROM "task_defs"
+            WHERE "task_defs"."name" = "tasks"."task_def_name" AND "tasks"."status" = 'in_progress';
+            """,
+            migrations.RunSQL.noop
+        ),
+        # leased tasks by deadline - expired leases are an index range scan
+        migrations.RunSQL(
+            "CREATE INDEX \"tasks_lease_expires_idx\" ON \"tasks\" (\"lease_expires_at\") WHERE (\"status\" = 'in_progress');",
+            "DROP INDEX \"tasks_lease_expires_idx\";"
+        ),
+        migrations.RunSQL(
+            "DROP INDEX \"tasks_in_progress_idx\";",
+            "CREATE INDEX \"tasks_in_progress_idx\" ON \"tasks\" (\"task_def_name\", \"locked_at\") WHERE (\"status\" = 'in_progress');"
+        )
+    ]
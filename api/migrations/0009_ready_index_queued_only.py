@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_task_lease_expires_at'),
+    ]
+
+    operations = [
+        # retries are moved back to queued by the queue_maintainer command, so the
+        # pull and its index only need queued tasks
+        migrations.RunSQL(
+            """
+            DROP INDEX "tasks_ready_idx";
+            CREATE INDEX "tasks_ready_idx" ON "tasks" ("task_def_name", "priority_rank", "run_at", "id") WHERE ("status" = 'queued');
+            """,
+            """
+            DROP INDEX "tasks_ready_idx";
+            CREATE INDEX "tasks_ready_idx" ON "tasks" ("task_def_name", "priority_rank", "run_at", "id") WHERE ("status" IN ('queued','failed_retrying'));
+            """
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX \"tasks_retrying_idx\" ON \"tasks\" (\"run_at\") WHERE (\"status\" = 'failed_retrying');",
+            "DROP INDEX \"tasks_retrying_idx\";"
+        ),
+        # only queued tasks can be pulled, so only they wake long polling pulls
+        migrations.RunSQL(
+            """
+            DROP TRIGGER tasks_notify_ready ON tasks;
+
+            CREATE TRIGGER tasks_notify_ready
+                AFTER UPDATE OF status, run_at ON tasks
+                FOR EACH ROW
+                WHEN (NEW.status = 'queued')
+                EXECUTE PROCEDURE tasks_notify_ready();
+
+            CREATE OR REPLACE FUNCTION tasks_notify_ready_inserted() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('tasks_ready', task_def_name || ' ' || run_at)
+                FROM (SELECT task_def_name, ceil(extract(epoch from run_at))::bigint AS run_at
+                      FROM inserted_tasks
+                      WHERE status = 'queued'
+                      GROUP BY 1, 2) ready;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            """
+            DROP TRIGGER tasks_notify_ready ON tasks;
+
+            CREATE TRIGGER tasks_notify_ready
+                AFTER UPDATE OF status, run_at ON tasks
+                FOR EACH ROW
+                WHEN (NEW.status IN ('queued', 'failed_retrying'))
+                EXECUTE PROCEDURE tasks_notify_ready();
+
+            CREATE OR REPLACE FUNCTION tasks_notify_ready_inserted() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('tasks_ready', task_def_name || ' ' || run_at)
+                FROM (SELECT task_def_name, ceil(extract(epoch from run_at))::bigint AS run_at
+                      FROM inserted_tasks
+                      WHERE status IN ('queued', 'failed_retrying')
+                      GROUP BY 1, 2) ready;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        )
+    ]
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_ready_index_queued_only'),
+    ]
+
+    operations = [
+        # task counts per task def and status, kept by statement level triggers so
+        # /stats/queues never counts `tasks`. Each backend adds its deltas to one of
+        # 8 slots, so concurrent pulls and acks don't all queue on the same counter
+        # row. Readers sum the slots.
+        migrations.RunSQL(
+            """
+            CREATE TABLE task_stats (
+                task_def_name varchar(255) NOT NULL,
+                status varchar(17) NOT NULL,
+                slot smallint NOT NULL,
+                count bigint NOT NULL,
+                PRIMARY KEY (task_def_name, status, slot)
+            );
+
+            CREATE FUNCTION task_stats_inserted() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO task_stats (task_def_name, status, slot, count)
+                SELECT task_def_name, status, pg_backend_pid() % 8, count(*)
+                FROM inserted_tasks
+                GROUP BY 1, 2
+                ORDER BY 1, 2
+                ON CONFLICT (task_def_name, status, slot)
+                DO UPDATE SET count = task_stats.count + EXCLUDED.count;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE FUNCTION task_stats_updated() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO task_stats (task_def_name, status, slot, count)
+                SELECT task_def_name, status, pg_backend_pid() % 8, sum(count)
+                FROM (SELECT task_def_name, status, count(*) AS count
+                      FROM new_tasks
+                      GROUP BY 1, 2
+                      UNION ALL
+                      SELECT task_def_name, status, -count(*)
+                      FROM old_tasks
+                      GROUP BY 1, 2) changes
+                GROUP BY 1, 2
+                HAVING sum(count) <> 0
+                ORDER BY 1, 2
+                ON CONFLICT (task_def_name, status, slot)
+                DO UPDATE SET count = task_stats.count + EXCLUDED.count;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE FUNCTION task_stats_deleted() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO task_stats (task_def_name, status, slot, count)
+                SELECT task_def_name, status, pg_backend_pid() % 8, -count(*)
+                FROM deleted_tasks
+                GROUP BY 1, 2
+                ORDER BY 1, 2
+                ON CONFLICT (task_def_name, status, slot)
+                DO UPDATE SET count = task_stats.count + EXCLUDED.count;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE FUNCTION task_stats_truncated() RETURNS trigger AS $$
+            BEGIN
+                DELETE FROM task_stats;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            LOCK TABLE tasks IN SHARE ROW EXCLUSIVE MODE;
+
+            INSERT INTO task_stats (task_def_name, status, slot, count)
+            SELECT task_def_name, status, 0, count(*)
+            FROM tasks
+            GROUP BY 1, 2;
+
+            CREATE TRIGGER task_stats_inserted
+                AFTER INSERT ON tasks
+                REFERENCING NEW TABLE AS inserted_tasks
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE task_stats_inserted();
+
+            CREATE TRIGGER task_stats_updated
+                AFTER UPDATE ON tasks
+                REFERENCING OLD TABLE AS old_tasks NEW TABLE AS new_tasks
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE task_stats_updated();
+
+            CREATE TRIGGER task_stats_deleted
+                AFTER DELETE ON tasks
+                REFERENCING OLD TABLE AS deleted_tasks
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE task_stats_deleted();
+
+            CREATE TRIGGER task_stats_truncated
+                AFTER TRUNCATE ON tasks
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE task_stats_truncated();
+            """,
+            """
+            DROP TRIGGER task_stats_truncated ON tasks;
+            DROP TRIGGER task_stats_deleted ON tasks;
+            DROP TRIGGER task_stats_updated ON tasks;
+            DROP TRIGGER task_stats_inserted ON tasks;
+            DROP FUNCTION task_stats_truncated();
+            DROP FUNCTION task_stats_deleted();
+            DROP FUNCTION task_stats_updated();
+            DROP FUNCTION task_stats_inserted();
+            DROP TABLE task_stats;
+            """
+        )
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_task_stats'),
+    ]
+
+    operations = [
+        # tells every process's task def cache to drop what it holds. Sent once per
+        # statement, and only delivered on commit.
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION task_defs_notify_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('task_defs_changed', '');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER task_defs_notify_changed
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON task_defs
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE task_defs_notify_changed();
+            """,
+            """
+            DROP TRIGGER task_defs_notify_changed ON task_defs;
+            DROP FUNCTION task_defs_notify_changed();
+            """
+        )
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_task_defs_notify_changed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskPayload',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'task_payloads',
+            },
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='data_digest',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        # payloads are already compressed, don't let TOAST try again
+        migrations.RunSQL(
+            "ALTER TABLE \"task_payloads\" ALTER COLUMN \"data\" SET STORAGE EXTERNAL;",
+            migrations.RunSQL.noop
+        )
+    ]
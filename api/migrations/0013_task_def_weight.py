@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_task_payloads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskdef',
+            name='weight',
+            field=models.IntegerField(default=1),
+        ),
+    ]
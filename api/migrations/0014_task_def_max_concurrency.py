@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_task_def_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskdef',
+            name='max_concurrency',
+            field=models.IntegerField(null=True),
+        ),
+        # pulls count the tasks in progress of task defs with a max_concurrency
+        migrations.RunSQL(
+            "CREATE INDEX \"tasks_in_progress_idx\" ON \"tasks\" (\"task_def_name\") WHERE (\"status\" = 'in_progress');",
+            "DROP INDEX \"tasks_in_progress_idx\";"
+        )
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_task_def_max_concurrency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskdef',
+            name='retry_delay',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='taskdef',
+            name='retry_backoff',
+            field=models.FloatField(default=2.0),
+        ),
+        migrations.AddField(
+            model_name='taskdef',
+            name='retry_jitter',
+            field=models.FloatField(default=0.1),
+        ),
+        migrations.AddField(
+            model_name='taskdef',
+            name='retry_max_delay',
+            field=models.IntegerField(default=3600),
+        ),
+    ]
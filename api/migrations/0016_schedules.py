@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_task_def_retry_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Schedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cron', models.CharField(max_length=255, null=True)),
+                ('interval', models.IntegerField(null=True)),
+                ('priority', models.CharField(choices=[('critical', 'Critical'), ('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='normal', max_length=8)),
+                ('timeout', models.IntegerField(null=True)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('catch_up', models.BooleanField(default=True)),
+                ('next_run_at', models.DateTimeField()),
+                ('last_run_at', models.DateTimeField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('task_def', models.ForeignKey(db_column='task_def_name', on_delete=django.db.models.deletion.CASCADE, to='api.TaskDef')),
+            ],
+            options={
+                'db_table': 'schedules',
+            },
+        ),
+        # the queue maintainer looks for enabled schedules that are due
+        migrations.RunSQL(
+            "CREATE INDEX \"schedules_due_idx\" ON \"schedules\" (\"next_run_at\") WHERE \"enabled\";",
+            "DROP INDEX \"schedules_due_idx\";"
+        )
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_schedules'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='task',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('queued', 'Queued'), ('in_progress', 'In Progress'), ('failed_retrying', 'Failed - Retrying'), ('dequeued', 'Dequeued'), ('failed', 'Failed'), ('completed', 'Completed')], default='queued', max_length=17),
+        ),
+        # the queue maintainer promotes scheduled tasks in run_at order
+        migrations.RunSQL(
+            "CREATE INDEX \"tasks_scheduled_idx\" ON \"tasks\" (\"run_at\") WHERE (\"status\" = 'scheduled');",
+            "DROP INDEX \"tasks_scheduled_idx\";"
+        ),
+        # tasks already queued for later move out of the ready index, by the same
+        # horizon new tasks are scheduled by
+        migrations.RunSQL(
+            [("UPDATE tasks SET status = 'scheduled' WHERE status = 'queued' "
+              "AND run_at > NOW() + INTERVAL '1 second' * %s;", [settings.SCHEDULED_TASK_HORIZON])],
+            "UPDATE tasks SET status = 'queued' WHERE status = 'scheduled';"
+        )
+    ]
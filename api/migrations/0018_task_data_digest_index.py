@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_task_scheduled_status'),
+    ]
+
+    operations = [
+        # the queue maintainer checks each old payload for a task still using it
+        migrations.RunSQL(
+            "CREATE INDEX \"tasks_data_digest_idx\" ON \"tasks\" (\"data_digest\") WHERE (\"data_digest\" IS NOT NULL);",
+            "DROP INDEX \"tasks_data_digest_idx\";"
+        )
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_task_data_digest_index'),
+    ]
+
+    operations = [
+        # acks used to leave tasks as 'complete', which isn't one of the statuses
+        # and kept their `unique` taken, see the unique_task index
+        migrations.RunSQL(
+            "UPDATE tasks SET status = 'completed' WHERE status = 'complete';",
+            migrations.RunSQL.noop
+        )
+    ]
@@ -1,11 +1,15 @@
 from __future__ import unicode_literals
 
+import math
+import random
+
 from django.db import models
 from django.utils import timezone
 from django.core.validators import RegexValidator
 from django.contrib.postgres import fields as postgresfields
 
 STATUS_CHOICES = (
+    ("scheduled", "Scheduled"),
     ("queued", "Queued"),
     ("in_progress", "In Progress"),
     ("failed_retrying", "Failed - Retrying"),
@@ -21,6 +25,14 @@ PRIORITY_CHOICES = (
     ("low", "Low")
 )
 
+# integer sort key for `priority`, lower is pulled first
+PRIORITY_RANKS = {
+    "critical": 1,
+    "high": 2,
+    "normal": 3,
+    "low": 4
+}
+
 class TaskDef(models.Model):
     class Meta:
         db_table = "task_defs"
@@ -39,9 +51,31 @@ class TaskDef(models.Model):
     description = models.CharField(null=True, max_length=2048, blank=False) # optional description
     default_timeout = models.IntegerField(default=600) # default timeout, in seconds
     max_attempts = models.IntegerField(default=1) # max number of times this job can attempt to run
+    weight = models.IntegerField(default=1) # share of fair queue pulls, relative to the other task defs pulled
+    max_concurrency = models.IntegerField(null=True) # most tasks in progress at once, no limit if null
+    retry_delay = models.IntegerField(default=0) # seconds before the first retry of a failed task, 0 retries right away
+    retry_backoff = models.FloatField(default=2.0) # retry_delay is multiplied by this for each later attempt
+    retry_jitter = models.FloatField(default=0.1) # fraction of the delay taken off at random, spreading retries out
+    retry_max_delay = models.IntegerField(default=3600) # longest delay between retries, in seconds
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def retry_delay_seconds(self, attempts):
+        """Seconds to hold back a task that failed on attempt number `attempts`.
+        Matches the run_at set by ack_tasks_sql."""
+        if self.retry_delay <= 0:
+            return 0
+
+        ## the delay stops growing once it reaches retry_max_delay, so the
+        ## exponent does too, rather than overflowing on a high attempt count
+        exponent = 0
+        if self.retry_backoff > 1:
+            exponent = math.ceil(math.log(max(self.retry_max_delay, self.retry_delay) / self.retry_delay,
+                                          self.retry_backoff))
+
+        delay = min(self.retry_max_delay, self.retry_delay * self.retry_backoff ** min(attempts - 1, exponent))
+        return delay * (1 - self.retry_jitter * random.random())
+
 class Task(models.Model):
     class Meta:
         db_table = "tasks"
@@ -50,13 +84,50 @@ class Task(models.Model):
     status = models.CharField(choices=STATUS_CHOICES, max_length=17, default='queued')
     worker_id = models.CharField(null=True, max_length=255)
     locked_at = models.DateTimeField(null=True)
+    lease_expires_at = models.DateTimeField(null=True) # when an in progress task can be given to another worker
     priority = models.CharField(choices=PRIORITY_CHOICES, max_length=8, default="normal")
+    priority_rank = models.SmallIntegerField(default=PRIORITY_RANKS["normal"]) # derived from priority, used by the ready index
     unique = models.CharField(null=True, max_length=255)
     run_at = models.DateTimeField(default=lambda: timezone.now())
+    timeout = models.IntegerField(null=True) # overrides the task def's default_timeout, in seconds
     started_at = models.DateTimeField(null=True)
     completed_at = models.DateTimeField(null=True)
     failed_at = models.DateTimeField(null=True)
     data = postgresfields.JSONField(null=True)
+    data_digest = models.CharField(null=True, max_length=64) # set when data is offloaded to task_payloads
     attempts = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        self.priority_rank = PRIORITY_RANKS[self.priority]
+        super(Task, self).save(*args, **kwargs)
+
+class TaskPayload(models.Model):
+    """Large task data, stored once per distinct payload, zlib compressed"""
+    class Meta:
+        db_table = "task_payloads"
+
+    digest = models.CharField(primary_key=True, max_length=64) # sha256 of the uncompressed JSON
+    data = models.BinaryField()
+    size = models.IntegerField() # uncompressed bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class Schedule(models.Model):
+    """Queues a task of `task_def` on a cron expression or every `interval`
+    seconds. Runs are queued by the queue_maintainer command."""
+    class Meta:
+        db_table = "schedules"
+
+    task_def = models.ForeignKey(TaskDef, db_column="task_def_name")
+    cron = models.CharField(null=True, max_length=255) # five field cron expression, in UTC
+    interval = models.IntegerField(null=True) # seconds between runs, for schedules without a cron
+    priority = models.CharField(choices=PRIORITY_CHOICES, max_length=8, default="normal")
+    timeout = models.IntegerField(null=True)
+    data = postgresfields.JSONField(null=True)
+    enabled = models.BooleanField(default=True)
+    catch_up = models.BooleanField(default=True) # queue every run missed while runs weren't being queued, or only the latest
+    next_run_at = models.DateTimeField()
+    last_run_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,213 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connection
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+class KeysetPagination(BasePagination):
+    """Pages through a list by the position of the last row seen, instead of an
+    offset, so any page costs the same as the first one.
+
+    The list is ordered by one `ordering` field, with the primary key appended
+    to break ties. `next` and `previous` are opaque cursors holding the ordering
+    field's value and the primary key of the row at the edge of the page.
+
+    `count` is only calculated if asked for with `count=exact`, a full COUNT(*),
+    or `count=estimate`, the planner's row estimate for the filtered list.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.pk = self.model._meta.pk
+        self.field, self.descending = self.get_ordering(request, view)
+
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            position, pk, self.reverse = None, None, False
+        else:
+            position, pk, self.reverse = cursor
+
+        self.count = self.get_count(queryset, request)
+
+        # previous pages are read backwards from the cursor, then flipped
+        descending = self.descending != self.reverse
+        prefix = '-' if descending else ''
+
+        if self.field == self.pk:
+            queryset = queryset.order_by(prefix + self.pk.name)
+        else:
+            queryset = queryset.order_by(prefix + self.field.name, prefix + self.pk.name)
+
+        if cursor is not None:
+            where, params = self.get_after_clause(descending, position, pk)
+            queryset = queryset.extra(where=[where], params=params)
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_page_size(self, request):
+        if self.page_size_query_param not in request.query_params:
+            return self.page_size
+
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except ValueError:
+            raise ParseError('`limit` must be an integer')
+
+        if page_size < 1 or page_size > self.max_page_size:
+            raise ParseError('`limit` must be between 1 and {}'.format(self.max_page_size))
+
+        return page_size
+
+    def get_ordering(self, request, view):
+        """Returns the model field to order by, and whether it's descending"""
+        default = getattr(view, 'ordering', None) or (self.pk.name,)
+
+        ordering = request.query_params.get(self.ordering_query_param, None)
+        if not ordering:
+            ordering = default[0]
+
+        descending = ordering.startswith('-')
+        name = ordering.lstrip('-')
+
+        allowed = set(getattr(view, 'ordering_fields', ())) | set([self.pk.name, default[0].lstrip('-')])
+        if name not in allowed:
+            raise ParseError('`ordering` must be one of `{}`'.format('`, `'.join(sorted(allowed))))
+
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ParseError('`ordering` field `{}` does not exist'.format(name))
+
+        return field, descending
+
+    def get_count(self, queryset, request):
+        count = request.query_params.get(self.count_query_param, None)
+
+        if count is None:
+            return None
+        elif count == 'exact':
+            return queryset.count()
+        elif count == 'estimate':
+            return estimate_count(queryset)
+        else:
+            raise ParseError('`count` must be `exact` or `estimate`')
+
+    def get_after_clause(self, descending, position, pk):
+        """SQL matching the rows after a cursor, in the order the page is read.
+        Postgres sorts NULLs last ascending and first descending."""
+        opts = self.model._meta
+        column = '"{}"."{}"'.format(opts.db_table, self.field.column)
+        pk_column = '"{}"."{}"'.format(opts.db_table, self.pk.column)
+        op = '<' if descending else '>'
+
+        if self.field == self.pk:
+            return '{} {} %s'.format(column, op), [pk]
+
+        if position is None:
+            if descending:
+                where = '({column} IS NULL AND {pk} < %s) OR {column} IS NOT NULL'
+            else:
+                where = '{column} IS NULL AND {pk} > %s'
+            return where.format(column=column, pk=pk_column), [pk]
+
+        where = '({column}, {pk}) {op} (%s, %s)'
+        if self.field.null and not descending:
+            where += ' OR {column} IS NULL'
+        return where.format(column=column, pk=pk_column, op=op), [position, pk]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param, None)
+        if encoded is None:
+            return None
+
+        try:
+            name, position, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if name != self.field.name:
+                raise ParseError('`cursor` is for a different `ordering`')
+            if position is not None:
+                position = self.field.to_python(position)
+            pk = self.pk.to_python(pk)
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            raise ParseError('`cursor` is invalid')
+
+        return position, pk, bool(reverse)
+
+    def encode_cursor(self, instance, reverse):
+        ## pages may be model instances, or dict rows from QuerySet.values()
+        if isinstance(instance, dict):
+            position = instance[self.field.attname]
+            pk = instance[self.pk.attname]
+        else:
+            position = getattr(instance, self.field.attname)
+            pk = instance.pk
+
+        if isinstance(position, datetime.datetime):
+            position = position.isoformat()
+
+        cursor = json.dumps([self.field.name, position, pk, reverse])
+        encoded = base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], True)
+
+def estimate_count(queryset):
+    """Row count the planner expects the queryset to return, from table stats"""
+    sql, params = queryset.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]['Plan']['Plan Rows']
@@ -0,0 +1,37 @@
+import json
+
+import msgpack
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+from rest_framework.exceptions import ParseError
+
+class NDJSONParser(BaseParser):
+    """Parses newline delimited JSON into a list, one item per non-blank line"""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        items = []
+        for line_number, line in enumerate(stream, 1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+
+            try:
+                items.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError('NDJSON parse error on line {} - {}'.format(line_number, exc))
+
+        return items
+
+class MessagePackParser(BaseParser):
+    """Parses a MessagePack request body"""
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except Exception as exc:
+            raise ParseError('MessagePack parse error - {}'.format(exc))
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import zlib
+
+from django.conf import settings
+from django.db import connection
+from rest_framework import exceptions
+
+# unreferenced payloads are kept for this many seconds before they're deleted, so
+# one stored for a task that is still being written isn't deleted under it
+UNREFERENCED_PAYLOAD_SECONDS = 3600
+
+class PayloadMissing(exceptions.APIException):
+    status_code = 500
+    default_detail = 'Task data is missing from task_payloads'
+
+# Identical payloads share a row, and payloads are never updated in place. Storing
+# a payload that already exists moves its created_at on, at most once a minute,
+# so delete_unreferenced_sql leaves it alone until the task using it is written.
+store_payloads_sql = """
+INSERT INTO task_payloads (digest, data, size, created_at)
+SELECT digest, data, size, NOW()
+FROM unnest(%(digests)s::varchar[], %(datas)s::bytea[], %(sizes)s::integer[]) AS payloads(digest, data, size)
+ORDER BY digest
+ON CONFLICT (digest) DO UPDATE SET
+    created_at = NOW()
+WHERE task_payloads.created_at < NOW() - INTERVAL '1 minute';
+"""
+
+# Payloads no task refers to any more, since the task's data was replaced or the
+# task deleted. Looked up through tasks_data_digest_idx.
+delete_unreferenced_sql = """
+WITH unreferenced as (
+    SELECT digest
+    FROM task_payloads
+    WHERE
+        created_at < NOW() - INTERVAL '1 second' * %(age)s
+        AND NOT EXISTS (SELECT 1 FROM tasks WHERE tasks.data_digest = task_payloads.digest)
+    LIMIT %(batch_size)s
+    FOR UPDATE SKIP LOCKED
+)
+DELETE FROM task_payloads
+USING unreferenced
+WHERE task_payloads.digest = unreferenced.digest;
+"""
+
+load_payload_sql = """
+SELECT data FROM task_payloads WHERE digest = %s;
+"""
+
+def offload_many(datas):
+    """Stores each task data larger than TASK_DATA_OFFLOAD_BYTES, as JSON, in
+    task_payloads. Returns a list of (data, data_digest) to save on each task:
+    (data, None) for data kept inline, (None, digest) for offloaded data."""
+    threshold = settings.TASK_DATA_OFFLOAD_BYTES
+
+    results = []
+    payloads = {}
+    for data in datas:
+        if data == None:
+            results.append((None, None))
+            continue
+
+        encoded = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        if len(encoded) <= threshold:
+            results.append((data, None))
+            continue
+
+        digest = hashlib.sha256(encoded).hexdigest()
+        payloads[digest] = encoded
+        results.append((None, digest))
+
+    if payloads:
+        digests = sorted(payloads)
+        with connection.cursor() as cursor:
+            cursor.execute(store_payloads_sql, {
+                'digests': digests,
+                'datas': [zlib.compress(payloads[digest]) for digest in digests],
+                'sizes': [len(payloads[digest]) for digest in digests]
+            })
+
+    return results
+
+def offload(data):
+    return offload_many([data])[0]
+
+def load(digest):
+    """The offloaded data's JSON, as bytes, or None if there is none"""
+    with connection.cursor() as cursor:
+        cursor.execute(load_payload_sql, [digest])
+        row = cursor.fetchone()
+
+    if row == None:
+        return None
+
+    return zlib.decompress(bytes(row[0]))
+
+def delete_unreferenced(batch_size=1000):
+    """Deletes up to `batch_size` payloads that no task has referred to for
+    UNREFERENCED_PAYLOAD_SECONDS. Returns the count."""
+    with connection.cursor() as cursor:
+        cursor.execute(delete_unreferenced_sql, {'batch_size': batch_size, 'age': UNREFERENCED_PAYLOAD_SECONDS})
+        return cursor.rowcount
@@ -0,0 +1,85 @@
+import re
+
+from django.conf import settings
+from django.db import connection, DatabaseError
+from psycopg2 import errorcodes
+
+PLACEHOLDER = re.compile(r'%\((\w+)\)s')
+
+# bounds the statements one connection holds, past this they're sent as text
+MAX_PER_CONNECTION = 64
+
+class PreparedStatement(object):
+    """A query prepared once per database connection, and then executed by name,
+    so Postgres doesn't parse and plan it again on every call.
+
+    `sql` uses the usual `%(name)s` placeholders, `params` lists each name with
+    its Postgres type, in the order they become `$1`, `$2`, ...
+
+    Prepared statements belong to the server session, so they're tracked per
+    underlying connection and prepared again after a reconnect. If the server
+    has lost one anyway (a DISCARD ALL, or a pooler handing over another
+    session) it is prepared again and, outside a transaction, retried once.
+    Inside one the error is raised, see `deallocated`, and the caller may
+    retry the transaction.
+    """
+
+    def __init__(self, name, sql, params):
+        self.name = name
+        self.sql = sql
+        self.param_names = [param_name for param_name, _ in params]
+
+        positions = dict((param_name, i + 1) for i, param_name in enumerate(self.param_names))
+        body = PLACEHOLDER.sub(lambda match: '${}'.format(positions[match.group(1)]), sql)
+        body = body.strip().rstrip(';')
+
+        self.prepare_sql = 'PREPARE {}({}) AS {}'.format(
+            name, ', '.join(pg_type for _, pg_type in params), body)
+        self.execute_sql = 'EXECUTE {}({})'.format(name, ', '.join(['%s'] * len(params)))
+
+    def execute(self, cursor, params):
+        if not getattr(settings, 'PREPARED_STATEMENTS', True):
+            cursor.execute(self.sql, params)
+            return
+
+        prepared = prepared_names()
+        if self.name not in prepared and len(prepared) >= MAX_PER_CONNECTION:
+            cursor.execute(self.sql, params)
+            return
+
+        values = [params[param_name] for param_name in self.param_names]
+
+        if self.name not in prepared:
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+
+        try:
+            cursor.execute(self.execute_sql, values)
+        except DatabaseError as e:
+            if not deallocated(e):
+                raise
+
+            prepared.discard(self.name)
+            ## a failed statement aborts the transaction, so only retry outside one
+            if connection.in_atomic_block:
+                raise
+
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+            cursor.execute(self.execute_sql, values)
+
+def deallocated(error):
+    """True if `error` is the server not knowing a prepared statement. The
+    statement is already forgotten, the next execute prepares it again."""
+    return getattr(error.__cause__, 'pgcode', None) == errorcodes.INVALID_SQL_STATEMENT_NAME
+
+def prepared_names():
+    """Names prepared on the current connection. Starts empty for a new one."""
+    raw = connection.connection
+    tracked = getattr(connection, 'prepared_statements', None)
+
+    if tracked is None or tracked[0] is not raw:
+        tracked = (raw, set())
+        connection.prepared_statements = tracked
+
+    return tracked[1]
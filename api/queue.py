@@ -1,54 +1,244 @@
-from django.db import connection
+import hashlib
+import json
+import select
+import time
+from contextlib import contextmanager
+from functools import lru_cache
 
-from api.models import TaskDef, Task
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
 
+from api.models import PRIORITY_RANKS
+from api import metrics, payloads, prepared
+from api.prepared import PreparedStatement
+
+# Ready tasks are read per task def through tasks_ready_idx, so each lookup is
+# an ordered index scan that stops at `limit` rows. Only queued tasks are read,
+# expired leases and retries are put back in the queue, and scheduled tasks are
+# promoted to queued shortly before their run_at, by the queue_maintainer
+# command. Tasks due later than that aren't in the index at all. A task def
+# with a max_concurrency only gets as many tasks as it has free slots, counted
+# through tasks_in_progress_idx, see lock_capped_task_defs_sql.
+#
+# The candidates are read without locks, only to count how many of the pull
+# each task def gets. Each task def then locks that many of its tasks, skipping
+# any another pull holds, so a pull locks the tasks it issues and no more.
 get_task_sql = """
-WITH nextTasks as (
-    SELECT id, status, started_at
-    FROM tasks
-    JOIN task_defs
-    ON tasks.task_def_name = task_defs.name
-    WHERE
-       task_def_name = ANY(%s)
-       AND run_at <= NOW()
-       AND (status = 'queued' OR
-           (status = 'in_progress' AND
-            (NOW() > (locked_at + INTERVAL '1 second' * task_defs.default_timeout))) OR
-           (status = 'failed_retrying' AND
-            attempts < task_defs.max_attempts))
-    ORDER BY
-        CASE WHEN priority = 'critical'
-             THEN 1
-             WHEN priority = 'high'
-             THEN 2
-             WHEN priority = 'normal'
-             THEN 3
-             WHEN priority = 'low'
-             THEN 4
+WITH candidates as (
+    SELECT task_names.name
+    FROM unnest(%(task_names)s::varchar[]) AS task_names(name)
+    JOIN task_defs ON task_defs.name = task_names.name
+    CROSS JOIN LATERAL (
+        SELECT priority_rank, run_at, id
+        FROM tasks
+        WHERE
+           task_def_name = task_names.name
+           AND status = 'queued'
+           AND run_at <= NOW()
+        ORDER BY priority_rank, run_at, id
+        LIMIT LEAST(%(limit)s,
+                    CASE WHEN task_defs.max_concurrency IS NOT NULL
+                         THEN GREATEST(task_defs.max_concurrency - (SELECT count(*)
+                                                                    FROM tasks in_progress
+                                                                    WHERE
+                                                                        in_progress.task_def_name = task_names.name
+                                                                        AND in_progress.status = 'in_progress'), 0)
+                    END)
+    ) ready
+    ORDER BY ready.priority_rank, ready.run_at, ready.id
+    LIMIT %(limit)s
+),
+shares as (
+    SELECT name, count(*) AS share
+    FROM candidates
+    GROUP BY name
+),
+nextTasks as (
+    SELECT locked.id, locked.started_at
+    FROM shares
+    CROSS JOIN LATERAL (
+        SELECT id, started_at
+        FROM tasks
+        WHERE
+           task_def_name = shares.name
+           AND status = 'queued'
+           AND run_at <= NOW()
+        ORDER BY priority_rank, run_at, id
+        LIMIT shares.share
+        FOR UPDATE SKIP LOCKED
+    ) locked
+    LIMIT %(limit)s
+)
+UPDATE tasks SET
+    status = 'in_progress',
+    worker_id = %(worker_id)s,
+    locked_at = NOW(),
+    lease_expires_at = NOW() + INTERVAL '1 second' * COALESCE(tasks.timeout, task_defs.default_timeout),
+    started_at =
+        CASE WHEN nextTasks.started_at = null
+             THEN NOW()
+             ELSE null
         END,
-        run_at
-    LIMIT %s
-    FOR UPDATE SKIP LOCKED
+    attempts = tasks.attempts + 1
+FROM nextTasks, task_defs
+WHERE
+    tasks.id = nextTasks.id
+    AND task_defs.name = tasks.task_def_name
+RETURNING {returning};
+"""
+
+# Fair pulls read the same per task def candidates, then interleave the task defs
+# in proportion to their weights instead of taking the oldest tasks overall. Each
+# task def's candidates are spaced out like arrivals at a rate of `weight`, with
+# random exponential gaps, so the next task comes from a task def with
+# probability weight / total weight, whatever its backlog. Priority still wins.
+get_fair_task_sql = """
+WITH candidates as (
+    SELECT task_names.name
+    FROM unnest(%(task_names)s::varchar[]) AS task_names(name)
+    JOIN task_defs ON task_defs.name = task_names.name
+    CROSS JOIN LATERAL (
+        SELECT priority_rank, run_at, id, -ln(1 - random()) AS gap
+        FROM tasks
+        WHERE
+           task_def_name = task_names.name
+           AND status = 'queued'
+           AND run_at <= NOW()
+        ORDER BY priority_rank, run_at, id
+        LIMIT LEAST(%(limit)s,
+                    CASE WHEN task_defs.max_concurrency IS NOT NULL
+                         THEN GREATEST(task_defs.max_concurrency - (SELECT count(*)
+                                                                    FROM tasks in_progress
+                                                                    WHERE
+                                                                        in_progress.task_def_name = task_names.name
+                                                                        AND in_progress.status = 'in_progress'), 0)
+                    END)
+    ) ready
+    ORDER BY
+        ready.priority_rank,
+        SUM(ready.gap) OVER (PARTITION BY task_names.name, ready.priority_rank
+                             ORDER BY ready.run_at, ready.id) / task_defs.weight
+    LIMIT %(limit)s
+),
+shares as (
+    SELECT name, count(*) AS share
+    FROM candidates
+    GROUP BY name
+),
+nextTasks as (
+    SELECT locked.id, locked.started_at
+    FROM shares
+    CROSS JOIN LATERAL (
+        SELECT id, started_at
+        FROM tasks
+        WHERE
+           task_def_name = shares.name
+           AND status = 'queued'
+           AND run_at <= NOW()
+        ORDER BY priority_rank, run_at, id
+        LIMIT shares.share
+        FOR UPDATE SKIP LOCKED
+    ) locked
+    LIMIT %(limit)s
 )
 UPDATE tasks SET
     status = 'in_progress',
-    worker_id = %s,
+    worker_id = %(worker_id)s,
     locked_at = NOW(),
+    lease_expires_at = NOW() + INTERVAL '1 second' * COALESCE(tasks.timeout, task_defs.default_timeout),
     started_at =
         CASE WHEN nextTasks.started_at = null
              THEN NOW()
              ELSE null
         END,
-    attempts =
-        CASE WHEN nextTasks.status = 'in_progress'
-             THEN attempts
-             ELSE attempts + 1
-        END
-FROM nextTasks
-WHERE tasks.id = nextTasks.id
-RETURNING tasks.*;
+    attempts = tasks.attempts + 1
+FROM nextTasks, task_defs
+WHERE
+    tasks.id = nextTasks.id
+    AND task_defs.name = tasks.task_def_name
+RETURNING {returning};
+"""
+
+# Pulls of task defs with a max_concurrency take turns. Their rows are locked in a
+# statement of their own before the pull, so the pull's snapshot includes the
+# tasks issued by the pull before it, and its slot count is current. Which task
+# defs are capped is read here, in the pull's transaction, so a max_concurrency
+# set moments ago is honoured. NO KEY UPDATE doesn't block the foreign key
+# checks of tasks being queued.
+lock_capped_task_defs_sql = """
+SELECT name
+FROM task_defs
+WHERE
+    name = ANY(%s)
+    AND max_concurrency IS NOT NULL
+ORDER BY name
+FOR NO KEY UPDATE;
+"""
+
+# soonest run_at of a task that is waiting on the clock, rather than on a worker
+next_run_at_sql = """
+SELECT ceil(extract(epoch from MIN(run_at)))::bigint
+FROM tasks
+WHERE
+   task_def_name = ANY(%s)
+   AND status = 'queued'
+   AND run_at > NOW();
+"""
+
+# Inserts a batch of tasks in one statement. The batch is sent as a single JSON
+# array, which is far cheaper to encode and parse than one array per column.
+# A task whose `unique` is taken is skipped by the ON CONFLICT clause, which
+# targets the unique_task partial index. Ids are drawn from the sequence up
+# front, so each input row is matched to its task by id rather than relying on
+# the order RETURNING comes back in. One row per input, in input order, with a
+# NULL id for the skipped tasks. Tasks due beyond the horizon are inserted as
+# scheduled.
+enqueue_tasks_sql = """
+WITH input as (
+    SELECT nextval(pg_get_serial_sequence('tasks', 'id')) AS id, input.*
+    FROM ROWS FROM (
+        jsonb_to_recordset(%(tasks)s::jsonb) AS (task_def_name varchar, priority varchar, priority_rank smallint,
+                                                 "unique" varchar, run_at timestamptz, timeout integer, data jsonb,
+                                                 data_digest varchar)
+    ) WITH ORDINALITY AS input(task_def_name, priority, priority_rank, "unique", run_at, timeout, data,
+                               data_digest, position)
+),
+inserted as (
+    INSERT INTO tasks (id, task_def_name, status, priority, priority_rank, "unique",
+                       run_at, timeout, data, data_digest, attempts, created_at, updated_at)
+    SELECT id, task_def_name,
+           CASE WHEN run_at > NOW() + INTERVAL '1 second' * %(horizon)s
+                THEN 'scheduled'
+                ELSE 'queued'
+           END,
+           priority, priority_rank, "unique",
+           COALESCE(run_at, NOW()), timeout, data, data_digest, 0, NOW(), NOW()
+    FROM input
+    ORDER BY position
+    ON CONFLICT (task_def_name, "unique") WHERE status NOT IN ('dequeued', 'failed', 'completed')
+    DO NOTHING
+    RETURNING id
+)
+SELECT inserted.id
+FROM input
+LEFT JOIN inserted ON inserted.id = input.id
+ORDER BY input.position;
+"""
+
+# Status of a task created on its own, by the same test as enqueue_tasks_sql.
+# The database's clock decides, as it does for the pulls and the queue
+# maintainer, not the app server's.
+initial_status_sql = """
+SELECT
+    CASE WHEN %(run_at)s > NOW() + INTERVAL '1 second' * %(horizon)s
+         THEN 'scheduled'
+         ELSE 'queued'
+    END;
 """
 
+# NOTIFY channel fed by the tasks_notify_ready trigger
+READY_CHANNEL = 'tasks_ready'
+
 def dictfetchall(cursor):
     """Return all rows from a cursor as a list of dicts"""
     columns = [col[0] for col in cursor.description]
@@ -57,17 +247,153 @@ def dictfetchall(cursor):
         for row in cursor.fetchall()
     ]
 
-def get_tasks(task_names, worker_id, limit=1):
+def returning_columns(columns):
+    """RETURNING list for get_task_sql, `task_def_name` is always returned"""
+    if columns == None:
+        return 'tasks.*'
+
+    columns = ['task_def_name'] + [column for column in columns if column != 'task_def_name']
+    return ', '.join('tasks."{}"'.format(column) for column in columns)
+
+# The RETURNING list comes from the worker's `fields`, so only the most recent
+# lists are kept. Names are derived from the list, so one rebuilt after being
+# dropped still finds the statement prepared on the connection, and
+# prepared.MAX_PER_CONNECTION bounds how many each connection holds.
+@lru_cache(maxsize=16)
+def pull_statement(returning, fair=False):
+    """The prepared pull query for a RETURNING list, one per distinct list"""
+    name = 'pull_fair_tasks' if fair else 'pull_tasks'
+    if returning != 'tasks.*':
+        name += '_' + hashlib.md5(returning.encode('utf-8')).hexdigest()[:12]
+
+    sql = get_fair_task_sql if fair else get_task_sql
+    return PreparedStatement(name, sql.format(returning=returning),
+                             [('task_names', 'varchar[]'),
+                              ('limit', 'integer'),
+                              ('worker_id', 'varchar')])
+
+def pull_tasks(task_names, worker_id, limit=1, columns=None, fair=False):
+    """Issues up to `limit` ready tasks to `worker_id`, as dict rows of `tasks`.
+    `columns` limits the columns returned, from a fixed list, never user input.
+    `fair` shares the pull between the task defs by weight, see get_fair_task_sql.
+    Task defs at their max_concurrency are skipped."""
+    try:
+        return pull(task_names, worker_id, limit, columns, fair)
+    except DatabaseError as e:
+        ## the pull runs in a transaction, so a lost statement is retried here
+        if not prepared.deallocated(e) or connection.in_atomic_block:
+            raise
+        return pull(task_names, worker_id, limit, columns, fair)
+
+def pull(task_names, worker_id, limit, columns, fair):
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(lock_capped_task_defs_sql, [task_names])
+
+            statement = pull_statement(returning_columns(columns), fair)
+            statement.execute(cursor, {'task_names': task_names,
+                                       'limit': limit,
+                                       'worker_id': worker_id})
+            return dictfetchall(cursor)
+
+@contextmanager
+def listening(channel):
+    """LISTEN on `channel` for the duration of the block. The connection may be
+    reused by later requests, so it always UNLISTENs on the way out, and drops
+    the notifications that came in after the block stopped reading them."""
     with connection.cursor() as cursor:
-        cursor.execute(get_task_sql, [task_names, limit, worker_id])
-        raw_tasks = dictfetchall(cursor)
+        cursor.execute('LISTEN ' + channel)
+    try:
+        yield connection.connection
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('UNLISTEN ' + channel)
+        del connection.connection.notifies[:]
+
+def wait_for_ready(pg_connection, task_names, timeout):
+    """Blocks until a task for one of `task_names` may be ready or `timeout`
+    seconds pass. Returns True if woken for a task, False on timeout."""
+    deadline = time.time() + timeout
+
+    with connection.cursor() as cursor:
+        cursor.execute(next_run_at_sql, [task_names])
+        next_run_at = cursor.fetchone()[0]
+
+    while True:
+        now = time.time()
+
+        if next_run_at != None and next_run_at <= now:
+            return True
+
+        wake_at = deadline if next_run_at == None else min(deadline, next_run_at)
+        if wake_at <= now:
+            return False
 
-    for raw_task in raw_tasks:
-        task_name = raw_task.pop('task_def_name')
-        raw_task['task_def'] = TaskDef(name=task_name)
+        select.select([pg_connection], [], [], wake_at - now)
 
-    tasks = []
-    for raw_task in raw_tasks:
-        tasks.append(Task(**raw_task))
+        pg_connection.poll()
+        while pg_connection.notifies:
+            notify = pg_connection.notifies.pop(0)
+            task_name, run_at = notify.payload.split(' ')
+            if task_name not in task_names:
+                continue
+
+            run_at = int(run_at)
+            if run_at <= time.time():
+                return True
+            elif next_run_at == None or run_at < next_run_at:
+                next_run_at = run_at
+
+def get_tasks(task_names, worker_id, limit=1, wait=0, columns=None, fair=False):
+    """Pulls up to `limit` tasks. With a `wait` (in seconds), an empty pull parks
+    until a task is ready and then pulls once more, which may still come back
+    empty if another worker got there first. With `fair`, the task defs share
+    the pull by weight rather than by age."""
+    with metrics.PULL_SECONDS.labels('true' if wait > 0 else 'false').time():
+        if wait <= 0:
+            tasks = pull_tasks(task_names, worker_id, limit, columns, fair)
+        else:
+            ## listen before the first pull, so a task queued in between isn't missed
+            with listening(READY_CHANNEL) as pg_connection:
+                tasks = pull_tasks(task_names, worker_id, limit, columns, fair)
+
+                if len(tasks) == 0 and wait_for_ready(pg_connection, task_names, wait):
+                    tasks = pull_tasks(task_names, worker_id, limit, columns, fair)
+
+    metrics.record_pull(tasks)
 
     return tasks
+
+def initial_status(run_at):
+    """`scheduled` for a task due beyond SCHEDULED_TASK_HORIZON, `queued` otherwise"""
+    if run_at == None:
+        return 'queued'
+
+    with connection.cursor() as cursor:
+        cursor.execute(initial_status_sql, {'run_at': run_at, 'horizon': settings.SCHEDULED_TASK_HORIZON})
+        return cursor.fetchone()[0]
+
+def enqueue_tasks(tasks):
+    """Queues a list of validated task dicts (`task_def` name, `priority`, `unique`,
+    `run_at`, `timeout`, `data`). Returns a list in the same order, holding the new
+    task's id or None where `unique` conflicted with a task that is still live."""
+    offloaded = payloads.offload_many([task.get('data', None) for task in tasks])
+
+    rows = []
+    for task, (data, data_digest) in zip(tasks, offloaded):
+        priority = task.get('priority', 'normal')
+        run_at = task.get('run_at', None)
+        rows.append({
+            'task_def_name': task['task_def'],
+            'priority': priority,
+            'priority_rank': PRIORITY_RANKS[priority],
+            'unique': task.get('unique', None),
+            'run_at': None if run_at == None else run_at.isoformat(),
+            'timeout': task.get('timeout', None),
+            'data': data,
+            'data_digest': data_digest
+        })
+
+    with connection.cursor() as cursor:
+        cursor.execute(enqueue_tasks_sql, {'tasks': json.dumps(rows), 'horizon': settings.SCHEDULED_TASK_HORIZON})
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,19 @@
+import msgpack
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders MessagePack. Types MessagePack has no equivalent for, like
+    datetimes, are converted the same way the JSON renderer converts them."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    json_encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return msgpack.packb(data, use_bin_type=True, default=self.json_encoder.default)
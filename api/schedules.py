@@ -0,0 +1,207 @@
+import json
+from datetime import timedelta
+
+from django.db import connection, transaction
+
+from api import queue
+
+# @aliases for common cron expressions
+CRON_ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@hourly': '0 * * * *'
+}
+
+CRON_FIELDS = (('minute', 0, 59),
+               ('hour', 0, 23),
+               ('day of month', 1, 31),
+               ('month', 1, 12),
+               ('day of week', 0, 7))
+
+# a cron expression with no run in this many years, like Feb 30th, never runs
+MAX_YEARS_AHEAD = 8
+
+class Cron(object):
+    """A five field cron expression (minute, hour, day of month, month, day of
+    week) with `*`, lists, ranges and `/` steps, in UTC. As in cron, when both
+    day fields are restricted a day matching either one runs."""
+
+    def __init__(self, expression):
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError('cron expression must have 5 fields')
+
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            parse_cron_field(text, name, low, high) for text, (name, low, high) in zip(fields, CRON_FIELDS)]
+        self.weekdays = set(0 if day == 7 else day for day in weekdays)
+
+        self.any_day = fields[2].startswith('*')
+        self.any_weekday = fields[4].startswith('*')
+
+    def day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays # cron counts from Sunday
+
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment):
+        """The first run strictly after `moment`"""
+        run_at = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        last_year = run_at.year + MAX_YEARS_AHEAD
+
+        while run_at.year <= last_year:
+            if run_at.month not in self.months:
+                month = run_at.replace(day=1, hour=0, minute=0)
+                run_at = (month + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(run_at):
+                run_at = run_at.replace(hour=0, minute=0) + timedelta(days=1)
+            elif run_at.hour not in self.hours:
+                run_at = run_at.replace(minute=0) + timedelta(hours=1)
+            elif run_at.minute not in self.minutes:
+                run_at = run_at + timedelta(minutes=1)
+            else:
+                return run_at
+
+        raise ValueError('cron expression never runs')
+
+def parse_cron_field(text, name, low, high):
+    values = set()
+
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            if not step.isdigit() or int(step) < 1:
+                raise ValueError('invalid step in cron {} field'.format(name))
+            step = int(step)
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = part.split('-', 1)
+            if not start.isdigit() or not end.isdigit():
+                raise ValueError('invalid range in cron {} field'.format(name))
+            start, end = int(start), int(end)
+        elif part.isdigit():
+            start = int(part)
+            end = high if step > 1 else start
+        else:
+            raise ValueError('invalid cron {} field'.format(name))
+
+        if start < low or end > high or start > end:
+            raise ValueError('cron {} field must be between {} and {}'.format(name, low, high))
+
+        values.update(range(start, end + 1, step))
+
+    return values
+
+def first_run_at(cron, start):
+    """The first run of a schedule at or after `start`"""
+    if cron != None:
+        return Cron(cron).next_after(start - timedelta(microseconds=1))
+    return start
+
+def due_runs(schedule, now, limit):
+    """Up to `limit` runs of a due schedule from its next_run_at up to `now`, and
+    the next_run_at after them. Without catch_up only the latest run is kept."""
+    cron = Cron(schedule['cron']) if schedule['cron'] != None else None
+
+    def after(run_at):
+        if cron != None:
+            return cron.next_after(run_at)
+        return run_at + timedelta(seconds=schedule['interval'])
+
+    run_at = schedule['next_run_at']
+
+    if not schedule['catch_up']:
+        if cron == None:
+            ## skip whole intervals, rather than stepping through them
+            missed = int((now - run_at).total_seconds() // schedule['interval'])
+            run_at += timedelta(seconds=missed * schedule['interval'])
+        else:
+            while after(run_at) <= now:
+                run_at = after(run_at)
+        return [run_at], after(run_at)
+
+    runs = []
+    while run_at <= now and len(runs) < limit:
+        runs.append(run_at)
+        run_at = after(run_at)
+
+    return runs, run_at
+
+# Due schedules are locked for the tick, so maintainers running side by side
+# each take different schedules.
+due_schedules_sql = """
+SELECT id, task_def_name, cron, "interval", catch_up, priority, timeout, data, next_run_at, NOW() AS now
+FROM schedules
+WHERE
+    enabled
+    AND next_run_at <= NOW()
+ORDER BY next_run_at
+LIMIT %(batch_size)s
+FOR UPDATE SKIP LOCKED;
+"""
+
+advance_schedules_sql = """
+UPDATE schedules SET
+    next_run_at = advanced.next_run_at,
+    last_run_at = advanced.last_run_at,
+    updated_at = NOW()
+FROM jsonb_to_recordset(%s::jsonb) AS advanced(id integer, next_run_at timestamptz, last_run_at timestamptz)
+WHERE schedules.id = advanced.id;
+"""
+
+def materialize(batch_size=1000):
+    """Queues the runs of due schedules, up to `batch_size` tasks, in one INSERT,
+    and moves the schedules on, all in one transaction. A schedule that missed
+    runs while nothing was materializing catches up here too. Each task's
+    `unique` is its schedule and run time, so a run is never queued twice while
+    the task is live. Returns (tasks queued, whether more runs are due)."""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(due_schedules_sql, {'batch_size': batch_size})
+            schedules = queue.dictfetchall(cursor)
+
+        tasks = []
+        advanced = []
+        more = len(schedules) == batch_size
+
+        for schedule in schedules:
+            budget = batch_size - len(tasks)
+            if budget <= 0:
+                more = True
+                break
+
+            runs, next_run_at = due_runs(schedule, schedule['now'], budget)
+            if next_run_at <= schedule['now']:
+                more = True
+
+            for run_at in runs:
+                tasks.append({
+                    'task_def': schedule['task_def_name'],
+                    'priority': schedule['priority'],
+                    'unique': 'schedule-{}-{}'.format(schedule['id'], int(run_at.timestamp())),
+                    'run_at': run_at,
+                    'timeout': schedule['timeout'],
+                    'data': schedule['data']
+                })
+
+            advanced.append({'id': schedule['id'],
+                             'next_run_at': next_run_at.isoformat(),
+                             'last_run_at': runs[-1].isoformat()})
+
+        if not advanced:
+            return 0, False
+
+        ids = queue.enqueue_tasks(tasks)
+
+        with connection.cursor() as cursor:
+            cursor.execute(advance_schedules_sql, [json.dumps(advanced)])
+
+    return len([id for id in ids if id != None]), more
@@ -1,6 +1,10 @@
+from datetime import timedelta
+
 from rest_framework import serializers, exceptions
 from django.db.utils import IntegrityError
-from api.models import TaskDef, Task, PRIORITY_CHOICES
+from django.utils import timezone
+from api.models import TaskDef, Task, Schedule, PRIORITY_CHOICES
+from api import queue, transitions, metrics, cache, payloads, schedules
 
 class UniqueTaskConflict(exceptions.APIException):
     status_code = 409
@@ -12,65 +16,291 @@ class TaskDefSerializer(serializers.Serializer):
     description = serializers.CharField(required=False, allow_null=True, allow_blank=False, max_length=2048)
     default_timeout = serializers.IntegerField(required=False)
     max_attempts = serializers.IntegerField(required=False)
+    weight = serializers.IntegerField(required=False, min_value=1, max_value=1000)
+    max_concurrency = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    retry_delay = serializers.IntegerField(required=False, min_value=0)
+    retry_backoff = serializers.FloatField(required=False, min_value=1, max_value=1000)
+    retry_jitter = serializers.FloatField(required=False, min_value=0, max_value=1)
+    retry_max_delay = serializers.IntegerField(required=False, min_value=0)
     created_at = serializers.DateTimeField(read_only=True, format='iso-8601')
     updated_at = serializers.DateTimeField(read_only=True, format='iso-8601')
 
     def create(self, validated_data):
         try:
-            return TaskDef.objects.create(**validated_data)
+            task_def = TaskDef.objects.create(**validated_data)
         except IntegrityError:
             raise exceptions.ValidationError({'name': '"{name}" already taken.'.format(**validated_data)})
 
+        ## other processes drop theirs when the change commits
+        cache.task_defs.clear()
+        return task_def
+
     def update(self, instance, validated_data):
         instance.title = validated_data.get('title', instance.title)
         instance.description = validated_data.get('description', instance.description)
         instance.default_timeout = validated_data.get('default_timeout', instance.default_timeout)
         instance.max_attempts = validated_data.get('max_attempts', instance.max_attempts)
+        instance.weight = validated_data.get('weight', instance.weight)
+        instance.max_concurrency = validated_data.get('max_concurrency', instance.max_concurrency)
+        instance.retry_delay = validated_data.get('retry_delay', instance.retry_delay)
+        instance.retry_backoff = validated_data.get('retry_backoff', instance.retry_backoff)
+        instance.retry_jitter = validated_data.get('retry_jitter', instance.retry_jitter)
+        instance.retry_max_delay = validated_data.get('retry_max_delay', instance.retry_max_delay)
         instance.save()
+
+        cache.task_defs.clear()
         return instance
 
+class TaskDefField(serializers.PrimaryKeyRelatedField):
+    """Task def by name, looked up in the task def cache"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not isinstance(data, (str, int)):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        task_def = cache.task_defs.get(str(data))
+        if task_def == None:
+            self.fail('does_not_exist', pk_value=data)
+
+        return task_def
+
 class TaskSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only=True)
-    task_def = serializers.PrimaryKeyRelatedField(required=True, queryset=TaskDef.objects.all())
+    task_def = TaskDefField(required=True, queryset=TaskDef.objects.all())
     status = serializers.CharField(read_only=True)
     worker_id = serializers.CharField(read_only=True, required=False, max_length=255)
     locked_at = serializers.DateTimeField(read_only=True, format='iso-8601')
+    lease_expires_at = serializers.DateTimeField(read_only=True, format='iso-8601')
     priority = serializers.ChoiceField(required=False, choices=PRIORITY_CHOICES)
     unique = serializers.CharField(required=False, max_length=255)
     run_at = serializers.DateTimeField(required=False, format='iso-8601', input_formats=['iso-8601'])
+    timeout = serializers.IntegerField(required=False, allow_null=True, min_value=1, max_value=86399)
     started_at = serializers.DateTimeField(required=False, allow_null=True, format='iso-8601', input_formats=['iso-8601'])
     completed_at = serializers.DateTimeField(required=False, allow_null=True, format='iso-8601', input_formats=['iso-8601'])
     failed_at = serializers.DateTimeField(required=False, allow_null=True, format='iso-8601', input_formats=['iso-8601'])
     data = serializers.JSONField(required=False, allow_null=True)
+    data_digest = serializers.CharField(read_only=True)
     attempts = serializers.IntegerField(read_only=True)
     created_at = serializers.DateTimeField(read_only=True, format='iso-8601')
     updated_at = serializers.DateTimeField(read_only=True, format='iso-8601')
 
     def create(self, validated_data):
+        if 'data' in validated_data:
+            validated_data['data'], validated_data['data_digest'] = payloads.offload(validated_data['data'])
+        validated_data['status'] = queue.initial_status(validated_data.get('run_at', None))
+
         try:
-            return Task.objects.create(**validated_data)
+            task = Task.objects.create(**validated_data)
         except IntegrityError:
+            metrics.TASK_WRITES.labels('create', 'conflict').inc()
             raise UniqueTaskConflict()
 
+        metrics.TASK_WRITES.labels('create', 'ok').inc()
+        return task
+
     def update(self, instance, validated_data):
         failed_at = validated_data.get('failed_at', None)
         completed_at = validated_data.get('completed_at', None)
         
         if failed_at == None and completed_at != None:
-            instance.status = 'complete'
+            instance.status = 'completed'
         elif failed_at != None and completed_at == None:
-            if instance.attempts >= instance.task_def.max_attempts:
+            task_def = cache.task_defs.get(instance.task_def_id)
+            if instance.attempts >= task_def.max_attempts:
                 instance.status = 'failed'
             else:
                 instance.status = 'failed_retrying'
+                delay = task_def.retry_delay_seconds(instance.attempts)
+                if delay > 0:
+                    ## retries are requeued straight away, run_at keeps them out of pulls until due
+                    instance.run_at = timezone.now() + timedelta(seconds=delay)
         elif failed_at != None and completed_at != None:
             raise exceptions.ValidationError('`failed_at` and `completed_at` cannot be both non-null at the same time.')
 
         instance.worker_id = validated_data.get('worker_id', instance.priority)
         instance.priority = validated_data.get('priority', instance.priority)
+        instance.timeout = validated_data.get('timeout', instance.timeout)
         instance.started_at = validated_data.get('started_at', instance.started_at)
         instance.completed_at = completed_at
         instance.failed_at = failed_at
-        instance.data = validated_data.get('data', instance.data)
+        if 'data' in validated_data:
+            instance.data, instance.data_digest = payloads.offload(validated_data['data'])
+        instance.save()
+
+        metrics.TASK_WRITES.labels('update', 'ok').inc()
+        if failed_at != None or completed_at != None:
+            metrics.TASKS_FINISHED.labels(instance.status).inc()
+
+        return instance
+
+class BulkTaskListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        attrs = super(BulkTaskListSerializer, self).to_internal_value(data)
+
+        task_def_names = set(task['task_def'] for task in attrs)
+        existing_names = set(cache.task_defs.get_many(task_def_names))
+
+        if task_def_names - existing_names:
+            errors = []
+            for task in attrs:
+                if task['task_def'] in existing_names:
+                    errors.append({})
+                else:
+                    errors.append({'task_def': ['Invalid pk "{}" - object does not exist.'.format(task['task_def'])]})
+            raise exceptions.ValidationError(errors)
+
+        return attrs
+
+    def create(self, validated_data):
+        ids = queue.enqueue_tasks(validated_data)
+
+        return [{'id': id, 'conflict': id == None} for id in ids]
+
+class BulkTaskSerializer(serializers.Serializer):
+    """Input only, for queueing many tasks at once. `task_def` is checked against
+    the task defs in one query for the whole list, rather than once per task."""
+    task_def = serializers.CharField(required=True, allow_blank=False, max_length=255)
+    priority = serializers.ChoiceField(required=False, choices=PRIORITY_CHOICES)
+    unique = serializers.CharField(required=False, allow_null=True, max_length=255)
+    run_at = serializers.DateTimeField(required=False, input_formats=['iso-8601'])
+    timeout = serializers.IntegerField(required=False, allow_null=True, min_value=1, max_value=86399)
+    data = serializers.JSONField(required=False, allow_null=True)
+
+    class Meta:
+        list_serializer_class = BulkTaskListSerializer
+
+    def to_internal_value(self, data):
+        """Serializer.to_internal_value, trimmed down for validating thousands of
+        tasks per request. `data` still goes through JSONField's encoding check,
+        a MessagePack body can hold values JSON can't, like bytes."""
+        if not isinstance(data, dict):
+            return super(BulkTaskSerializer, self).to_internal_value(data)
+
+        ret = {}
+        errors = {}
+
+        for field_name, field in self.fields.items():
+            if field_name not in data:
+                if field.required:
+                    errors[field_name] = [field.error_messages['required']]
+                continue
+
+            try:
+                ret[field_name] = field.run_validation(data[field_name])
+            except exceptions.ValidationError as exc:
+                errors[field_name] = exc.detail
+
+        if errors:
+            raise exceptions.ValidationError(errors)
+
+        return ret
+
+class AckTaskListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        attrs = super(AckTaskListSerializer, self).to_internal_value(data)
+
+        ids = [ack['id'] for ack in attrs]
+        if len(set(ids)) != len(ids):
+            raise exceptions.ValidationError({'id': ['A task can only be acknowledged once per request.']})
+
+        return attrs
+
+    def create(self, validated_data):
+        results = transitions.ack_tasks(validated_data)
+
+        acks = []
+        for ack in validated_data:
+            status, found = results[ack['id']]
+            if status != None:
+                metrics.TASKS_FINISHED.labels(status).inc()
+                acks.append({'id': ack['id'], 'status': status, 'error': None})
+            elif found:
+                acks.append({'id': ack['id'], 'status': None, 'error': 'Task is not in progress for this worker'})
+            else:
+                acks.append({'id': ack['id'], 'status': None, 'error': 'Task not found'})
+
+        return acks
+
+class AckTaskSerializer(serializers.Serializer):
+    """Input only, for finishing many tasks at once"""
+    id = serializers.IntegerField(required=True)
+    worker_id = serializers.CharField(required=False, max_length=255)
+    completed_at = serializers.DateTimeField(required=False, allow_null=True, input_formats=['iso-8601'])
+    failed_at = serializers.DateTimeField(required=False, allow_null=True, input_formats=['iso-8601'])
+    data = serializers.JSONField(required=False, allow_null=True)
+
+    class Meta:
+        list_serializer_class = AckTaskListSerializer
+
+    def validate(self, attrs):
+        failed_at = attrs.get('failed_at', None)
+        completed_at = attrs.get('completed_at', None)
+
+        if failed_at != None and completed_at != None:
+            raise exceptions.ValidationError('`failed_at` and `completed_at` cannot be both non-null at the same time.')
+        elif failed_at == None and completed_at == None:
+            raise exceptions.ValidationError('One of `failed_at` or `completed_at` is required.')
+
+        return attrs
+
+class TouchTasksSerializer(serializers.Serializer):
+    """Input only, the tasks to extend the leases of. All of the worker's tasks if
+    `ids` is left out or empty."""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate_ids(self, value):
+        if len(value) > 1000:
+            raise exceptions.ValidationError('No more than 1000 tasks can be touched at once.')
+
+        return value
+
+class ScheduleSerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    task_def = TaskDefField(required=True, queryset=TaskDef.objects.all())
+    cron = serializers.CharField(required=False, allow_null=True, allow_blank=False, max_length=255)
+    interval = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    priority = serializers.ChoiceField(required=False, choices=PRIORITY_CHOICES)
+    timeout = serializers.IntegerField(required=False, allow_null=True, min_value=1, max_value=86399)
+    data = serializers.JSONField(required=False, allow_null=True)
+    enabled = serializers.BooleanField(required=False)
+    catch_up = serializers.BooleanField(required=False)
+    next_run_at = serializers.DateTimeField(required=False, format='iso-8601', input_formats=['iso-8601'])
+    last_run_at = serializers.DateTimeField(read_only=True, format='iso-8601')
+    created_at = serializers.DateTimeField(read_only=True, format='iso-8601')
+    updated_at = serializers.DateTimeField(read_only=True, format='iso-8601')
+
+    def validate(self, attrs):
+        cron = attrs.get('cron', getattr(self.instance, 'cron', None))
+        interval = attrs.get('interval', getattr(self.instance, 'interval', None))
+
+        if cron != None and interval != None:
+            raise exceptions.ValidationError('`cron` and `interval` cannot be both non-null at the same time.')
+        elif cron == None and interval == None:
+            raise exceptions.ValidationError('One of `cron` or `interval` is required.')
+
+        if cron != None:
+            try:
+                schedules.first_run_at(cron, attrs.get('next_run_at', timezone.now()))
+            except ValueError as e:
+                raise exceptions.ValidationError({'cron': [str(e)]})
+
+        return attrs
+
+    def create(self, validated_data):
+        start = validated_data.get('next_run_at', timezone.now())
+        validated_data['next_run_at'] = schedules.first_run_at(validated_data.get('cron', None), start)
+
+        return Schedule.objects.create(**validated_data)
+
+    def update(self, instance, validated_data):
+        rescheduled = any(name in validated_data for name in ['cron', 'interval', 'next_run_at'])
+
+        for name in ['task_def', 'cron', 'interval', 'priority', 'timeout', 'data', 'enabled', 'catch_up']:
+            setattr(instance, name, validated_data.get(name, getattr(instance, name)))
+
+        if rescheduled:
+            start = validated_data.get('next_run_at', timezone.now())
+            instance.next_run_at = schedules.first_run_at(instance.cron, start)
+
         instance.save()
         return instance
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+from django.db import connection
+
+from api.models import STATUS_CHOICES, PRIORITY_RANKS
+
+# task_stats is kept up to date by triggers on tasks, see migration 0010
+status_counts_sql = """
+SELECT task_def_name, status, sum(count)::bigint AS count
+FROM task_stats
+GROUP BY task_def_name, status
+HAVING sum(count) <> 0;
+"""
+
+# one ready index probe per task def and priority, instead of scanning the queue
+oldest_ready_sql = """
+SELECT task_defs.name, oldest.run_at
+FROM task_defs
+CROSS JOIN LATERAL (
+    SELECT min(ranked.run_at) AS run_at
+    FROM unnest(%(priority_ranks)s::smallint[]) AS ranks(priority_rank)
+    CROSS JOIN LATERAL (
+        SELECT run_at
+        FROM tasks
+        WHERE
+            task_def_name = task_defs.name
+            AND status = 'queued'
+            AND priority_rank = ranks.priority_rank
+            AND run_at <= NOW()
+        ORDER BY run_at
+        LIMIT 1
+    ) ranked
+) oldest
+ORDER BY task_defs.name;
+"""
+
+def queue_stats():
+    """Task counts by status, in progress count and oldest ready `run_at`, per task def"""
+    with connection.cursor() as cursor:
+        cursor.execute(oldest_ready_sql, {'priority_ranks': sorted(PRIORITY_RANKS.values())})
+        oldest_ready = cursor.fetchall()
+
+        cursor.execute(status_counts_sql)
+        counts = cursor.fetchall()
+
+    stats = OrderedDict()
+    for name, run_at in oldest_ready:
+        stats[name] = OrderedDict([
+            ('task_def', name),
+            ('statuses', OrderedDict((status, 0) for status, label in STATUS_CHOICES)),
+            ('in_flight', 0),
+            ('oldest_ready_run_at', run_at)
+        ])
+
+    for name, status, count in counts:
+        if name not in stats:
+            continue
+        stats[name]['statuses'][status] = count
+        if status == 'in_progress':
+            stats[name]['in_flight'] = count
+
+    return list(stats.values())
@@ -0,0 +1,9 @@
+from django.test.runner import DiscoverRunner
+
+from api import cache
+
+class TestRunner(DiscoverRunner):
+    def teardown_databases(self, old_config, **kwargs):
+        ## the task def cache's listening connection would keep the test database from being dropped
+        cache.task_defs.close()
+        super(TestRunner, self).teardown_databases(old_config, **kwargs)
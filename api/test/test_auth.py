@@ -0,0 +1,82 @@
+import time
+from unittest.mock import patch
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.test import override_settings
+from rest_framework.test import APITestCase, APIClient
+
+from api import auth
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                   serialization.PublicFormat.SubjectPublicKeyInfo).decode('ascii')
+
+def make_token(**claims):
+    payload = {'service': 'core'}
+    payload.update(claims)
+    return 'JWT ' + jwt.encode(payload, private_key, algorithm='RS256').decode('ascii')
+
+@override_settings(JWT_PUB_KEY=public_pem)
+class AuthTests(APITestCase):
+    def setUp(self):
+        auth.token_cache.clear()
+
+    def post_task_def(self, token, name):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=token)
+        return client.post('/task-defs', {'name': name}, format='json')
+
+    def test_verified_token_cached(self):
+        token = make_token(exp=int(time.time()) + 3600)
+
+        with patch('api.auth.jwt.decode', wraps=jwt.decode) as decode:
+            self.assertEqual(self.post_task_def(token, 'classifier-search').status_code, 201)
+            self.assertEqual(self.post_task_def(token, 'cleanup-workers').status_code, 201)
+
+        self.assertEqual(decode.call_count, 1)
+
+    def test_key_rotation(self):
+        token = make_token(exp=int(time.time()) + 3600)
+        self.assertEqual(self.post_task_def(token, 'classifier-search').status_code, 201)
+
+        other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        other_pem = other_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                        serialization.PublicFormat.SubjectPublicKeyInfo).decode('ascii')
+
+        with override_settings(JWT_PUB_KEY=other_pem):
+            self.assertEqual(self.post_task_def(token, 'cleanup-workers').status_code, 401)
+
+    def test_invalid_tokens_rejected(self):
+        expired = make_token(exp=int(time.time()) - 10)
+        immature = make_token(nbf=int(time.time()) + 3600)
+        forged = make_token()[:-4] + 'AAAA'
+
+        for token in [expired, immature, forged, expired]:
+            self.assertEqual(self.post_task_def(token, 'classifier-search').status_code, 401)
+
+        self.assertEqual(len(auth.token_cache.entries), 0)
+
+    def test_cache_respects_exp(self):
+        cache = auth.VerifiedTokenCache(ttl=300)
+        now = time.time()
+
+        cache.set('foo', {'service': 'core', 'exp': int(now) + 60})
+        self.assertEqual(cache.get('foo'), {'service': 'core', 'exp': int(now) + 60})
+
+        with patch('api.auth.time.time', return_value=now + 61):
+            self.assertEqual(cache.get('foo'), None)
+
+    def test_cache_bounded(self):
+        cache = auth.VerifiedTokenCache(max_size=2)
+
+        cache.set('foo', {'service': 'foo'})
+        cache.set('bar', {'service': 'bar'})
+        cache.get('foo')
+        cache.set('baz', {'service': 'baz'})
+
+        self.assertEqual(cache.get('bar'), None) # least recently used
+        self.assertEqual(cache.get('foo'), {'service': 'foo'})
+        self.assertEqual(cache.get('baz'), {'service': 'baz'})
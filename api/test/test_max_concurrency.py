@@ -0,0 +1,95 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from api import cache, queue, transitions
+from api.models import TaskDef, Task
+
+def create_tasks(task_def_name, count):
+    ## NOW() is fixed at the start of the test's transaction
+    run_at = timezone.now() - timedelta(minutes=1)
+    Task.objects.bulk_create([Task(task_def_id=task_def_name, run_at=run_at) for i in range(count)])
+
+class MaxConcurrencyTests(APITestCase):
+    def setUp(self):
+        TaskDef.objects.create(name='classifier-search', max_concurrency=2)
+        TaskDef.objects.create(name='cleanup-workers')
+        create_tasks('classifier-search', 10)
+        create_tasks('cleanup-workers', 10)
+
+    def test_pull_stops_at_limit(self):
+        tasks = queue.get_tasks(['classifier-search'], 'worker-1', 10)
+        self.assertEqual(len(tasks), 2)
+
+        self.assertEqual(queue.get_tasks(['classifier-search'], 'worker-2', 10), [])
+
+    def test_slot_freed_by_ack(self):
+        tasks = queue.get_tasks(['classifier-search'], 'worker-1', 10)
+
+        transitions.ack_tasks([{'id': tasks[0]['id'], 'completed_at': timezone.now()}])
+
+        tasks = queue.get_tasks(['classifier-search'], 'worker-1', 10)
+        self.assertEqual(len(tasks), 1)
+
+    def test_other_task_defs_unaffected(self):
+        tasks = queue.get_tasks(['classifier-search', 'cleanup-workers'], 'worker-1', 10)
+
+        task_defs = [task['task_def_name'] for task in tasks]
+        self.assertEqual(task_defs.count('classifier-search'), 2)
+        self.assertEqual(task_defs.count('cleanup-workers'), 8)
+
+    def test_fair_pull_stops_at_limit(self):
+        tasks = queue.get_tasks(['classifier-search'], 'worker-1', 10, fair=True)
+        self.assertEqual(len(tasks), 2)
+
+class ConcurrentPullTests(APITransactionTestCase):
+    def setUp(self):
+        TaskDef.objects.create(name='classifier-search', max_concurrency=3)
+        create_tasks('classifier-search', 50)
+
+    def pull_concurrently(self):
+        pulled = []
+        start = threading.Barrier(8)
+
+        def worker(worker_id):
+            try:
+                start.wait()
+                for i in range(5):
+                    pulled.extend(queue.get_tasks(['classifier-search'], worker_id, 2))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=('worker-{}'.format(i),)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return pulled
+
+    def test_limit_holds_under_concurrent_pulls(self):
+        self.assertEqual(len(self.pull_concurrently()), 3)
+        self.assertEqual(Task.objects.filter(status='in_progress').count(), 3)
+
+    def test_limit_read_from_database(self):
+        TaskDef.objects.filter(name='classifier-search').update(max_concurrency=None)
+        ## notifications are delivered asynchronously, let the update's arrive
+        ## before filling the cache
+        time.sleep(0.2)
+        self.assertEqual(cache.task_defs.get('classifier-search').max_concurrency, None)
+
+        ## set behind the cache's back, without the change notification
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('ALTER TABLE task_defs DISABLE TRIGGER task_defs_notify_changed')
+                cursor.execute("UPDATE task_defs SET max_concurrency = 2 WHERE name = 'classifier-search'")
+                cursor.execute('ALTER TABLE task_defs ENABLE TRIGGER task_defs_notify_changed')
+
+        time.sleep(0.2)
+        self.assertEqual(cache.task_defs.get('classifier-search').max_concurrency, None)
+
+        self.assertEqual(len(self.pull_concurrently()), 2)
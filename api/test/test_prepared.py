@@ -0,0 +1,99 @@
+import hashlib
+from datetime import timedelta
+
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITransactionTestCase
+
+from api import queue, prepared, transitions
+from api.models import TaskDef, Task
+
+def server_prepared_names():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT name FROM pg_prepared_statements')
+        return set(row[0] for row in cursor.fetchall())
+
+class PreparedStatementTests(APITransactionTestCase):
+    def setUp(self):
+        TaskDef.objects.create(name='classifier-search')
+        for i in range(3):
+            Task.objects.create(task_def_id='classifier-search',
+                                run_at=timezone.now() - timedelta(minutes=1))
+
+    def test_placeholders(self):
+        statement = prepared.PreparedStatement('example', 'SELECT %(a)s, %(b)s, %(a)s;\n',
+                                               [('a', 'integer'), ('b', 'varchar')])
+
+        self.assertEqual(statement.prepare_sql, 'PREPARE example(integer, varchar) AS SELECT $1, $2, $1')
+        self.assertEqual(statement.execute_sql, 'EXECUTE example(%s, %s)')
+
+    def test_pull_prepared_once(self):
+        tasks = queue.pull_tasks(['classifier-search'], 'worker-1')
+        self.assertEqual(len(tasks), 1)
+        self.assertIn('pull_tasks', server_prepared_names())
+
+        ## the max_concurrency lock, then the pull
+        with self.assertNumQueries(2):
+            tasks = queue.pull_tasks(['classifier-search'], 'worker-1')
+        self.assertEqual(len(tasks), 1)
+
+    def test_columns_prepared_separately(self):
+        tasks = queue.pull_tasks(['classifier-search'], 'worker-1', columns=['id'])
+        self.assertEqual(set(tasks[0].keys()), set(['task_def_name', 'id']))
+
+        tasks = queue.pull_tasks(['classifier-search'], 'worker-1')
+        self.assertIn('data', tasks[0])
+
+        names = [name for name in server_prepared_names() if name.startswith('pull_tasks')]
+        self.assertEqual(len(names), 2)
+
+    def test_pull_statements_bounded(self):
+        columns = ['id', 'status', 'priority', 'run_at', 'timeout', 'attempts']
+        returning = [queue.returning_columns(columns[:i] + columns[i + 1:] + [extra])
+                     for i in range(len(columns)) for extra in ['data', 'unique', 'worker_id']]
+        for each in returning:
+            queue.pull_statement(each)
+
+        self.assertEqual(queue.pull_statement.cache_info().currsize, 16)
+
+        ## a dropped statement is rebuilt under the same name
+        self.assertEqual(queue.pull_statement(returning[0]).name,
+                         'pull_tasks_' + hashlib.md5(returning[0].encode('utf-8')).hexdigest()[:12])
+
+    def test_transitions_prepared(self):
+        task = queue.pull_tasks(['classifier-search'], 'worker-1')[0]
+
+        transitions.touch_task(task['id'], 60, 'worker-1')
+        self.assertEqual(transitions.touch_tasks('worker-1', 60, [task['id']]), ([task['id']], []))
+        results = transitions.ack_tasks([{'id': task['id'], 'completed_at': timezone.now()}])
+        self.assertEqual(results[task['id']], ('completed', True))
+
+        self.assertTrue(set(['touch_task', 'touch_tasks', 'ack_tasks']) <= server_prepared_names())
+
+    def test_recovers_when_deallocated(self):
+        queue.pull_tasks(['classifier-search'], 'worker-1')
+
+        with connection.cursor() as cursor:
+            cursor.execute('DEALLOCATE ALL')
+
+        tasks = queue.pull_tasks(['classifier-search'], 'worker-1')
+        self.assertEqual(len(tasks), 1)
+        self.assertIn('pull_tasks', server_prepared_names())
+
+    def test_reprepared_after_reconnect(self):
+        queue.pull_tasks(['classifier-search'], 'worker-1')
+
+        connection.close()
+
+        tasks = queue.pull_tasks(['classifier-search'], 'worker-1')
+        self.assertEqual(len(tasks), 1)
+        self.assertIn('pull_tasks', server_prepared_names())
+
+    @override_settings(PREPARED_STATEMENTS=False)
+    def test_disabled(self):
+        connection.close()
+
+        tasks = queue.pull_tasks(['classifier-search'], 'worker-1')
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(server_prepared_names(), set())
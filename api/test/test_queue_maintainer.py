@@ -0,0 +1,82 @@
+from datetime import timedelta
+from io import StringIO
+
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from api.management.commands.queue_maintainer import Command
+from api.models import TaskDef, Task
+
+class QueueMaintainerTests(APITestCase):
+    def setUp(self):
+        self.task_def = TaskDef.objects.create(name='classifier-search', max_attempts=2)
+
+    def create_task(self, **kwargs):
+        return Task.objects.create(task_def=self.task_def, data={}, **kwargs)
+
+    def test_queue_maintainer(self):
+        expired = [self.create_task(status='in_progress',
+                                    worker_id='foo',
+                                    attempts=attempts,
+                                    locked_at=timezone.now() - timedelta(hours=2),
+                                    lease_expires_at=timezone.now() - timedelta(hours=1))
+                   for attempts in [1, 1, 2]]
+        held = self.create_task(status='in_progress',
+                                worker_id='foo',
+                                locked_at=timezone.now(),
+                                lease_expires_at=timezone.now() + timedelta(hours=1))
+        retrying = self.create_task(status='failed_retrying', attempts=1)
+        exhausted = self.create_task(status='failed_retrying', attempts=2)
+
+        out = StringIO()
+        call_command('queue_maintainer', once=True, batch_size=2, stdout=out)
+
+        self.assertIn('reclaimed=3 requeued=1 failed=1', out.getvalue())
+
+        for task in expired:
+            task.refresh_from_db()
+            self.assertEqual(task.status, 'queued')
+            self.assertEqual(task.worker_id, None)
+            self.assertEqual(task.lease_expires_at, None)
+
+        ## the expired lease didn't use up an attempt, even the last one
+        self.assertEqual([task.attempts for task in expired], [0, 0, 1])
+
+        held.refresh_from_db()
+        self.assertEqual(held.status, 'in_progress')
+        self.assertEqual(held.worker_id, 'foo')
+
+        retrying.refresh_from_db()
+        self.assertEqual(retrying.status, 'queued')
+
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, 'failed')
+
+class Stop(Exception):
+    pass
+
+class QueueMaintainerLoopTests(SimpleTestCase):
+    def test_survives_database_errors(self):
+        counts = {'reclaimed': 0, 'requeued': 0, 'failed': 0, 'scheduled': 0, 'promoted': 0, 'payloads_deleted': 0}
+        passes = [DatabaseError('server closed the connection unexpectedly'), counts, Stop()]
+
+        out = StringIO()
+        err = StringIO()
+        with patch.object(Command, 'run_pass', side_effect=passes) as run_pass, \
+             patch('api.management.commands.queue_maintainer.time.sleep'):
+            with self.assertRaises(Stop):
+                call_command('queue_maintainer', interval=0, stdout=out, stderr=err)
+
+        self.assertEqual(run_pass.call_count, 3)
+        self.assertIn('server closed the connection unexpectedly', err.getvalue())
+        self.assertIn('reclaimed=0', out.getvalue())
+
+    def test_once_raises(self):
+        with patch.object(Command, 'run_pass', side_effect=DatabaseError('deadlock detected')):
+            with self.assertRaises(DatabaseError):
+                call_command('queue_maintainer', once=True, stdout=StringIO(), stderr=StringIO())
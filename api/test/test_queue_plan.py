@@ -0,0 +1,88 @@
+import json
+
+from django.db import connection
+from django.test import TestCase
+
+from api.models import TaskDef
+from api import queue
+
+class QueuePlanTests(TestCase):
+    """Guards the pull query's plan against regressing to a table scan + sort"""
+
+    def setUp(self):
+        TaskDef.objects.create(name='classifier-search')
+        TaskDef.objects.create(name='cleanup-workers')
+
+    def grow_tasks(self, count):
+        """Appends `count` tasks, mostly finished work with a smaller backlog and
+        a handful of leased tasks, like a long running queue"""
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO tasks (task_def_name, status, priority, priority_rank, locked_at,
+                                   lease_expires_at, run_at, attempts, created_at, updated_at)
+                SELECT
+                    CASE WHEN r.def < 0.5 THEN 'classifier-search' ELSE 'cleanup-workers' END,
+                    CASE WHEN r.status < 0.6 THEN 'completed'
+                         WHEN r.status < 0.69 THEN 'failed'
+                         WHEN r.status < 0.99 THEN 'queued'
+                         ELSE 'in_progress'
+                    END,
+                    (ARRAY['critical', 'high', 'normal', 'low'])[r.rank],
+                    r.rank,
+                    NOW(),
+                    NOW() + INTERVAL '1 second' * (r.run_at * 1200 - 600),
+                    NOW() + INTERVAL '1 second' * (r.run_at * 172800 - 86400),
+                    0,
+                    NOW(),
+                    NOW()
+                FROM (SELECT random() AS def, random() AS status, random() AS run_at,
+                             1 + floor(random() * 4)::int AS rank
+                      FROM generate_series(1, %(count)s)) r
+            """, {'count': count})
+            cursor.execute('ANALYZE tasks')
+
+    def explain_pull(self, task_names):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + queue.get_task_sql.format(returning='tasks.*'),
+                           {'task_names': task_names, 'limit': 10, 'worker_id': 'foo'})
+            plan = cursor.fetchone()[0]
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return plan[0]['Plan']
+
+    def walk(self, node, sorted_above=False):
+        """Yields (node, sorted_above) where sorted_above is True if a Sort is
+        feeding off this node with no Limit in between"""
+        yield node, sorted_above
+
+        if node['Node Type'] == 'Sort':
+            sorted_above = True
+        elif node['Node Type'] == 'Limit':
+            sorted_above = False
+
+        for child in node.get('Plans', []):
+            yield from self.walk(child, sorted_above)
+
+    def assert_index_backed(self, task_names):
+        plan = self.explain_pull(task_names)
+
+        scans = [(node, sorted_above) for node, sorted_above in self.walk(plan)
+                 if node.get('Relation Name') == 'tasks' and 'Scan' in node['Node Type']]
+
+        self.assertTrue(len(scans) > 0)
+
+        for node, sorted_above in scans:
+            self.assertFalse(sorted_above, 'tasks scan is feeding a sort: ' + json.dumps(node))
+            self.assertIn(node['Node Type'], ['Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'])
+
+        index_names = [node.get('Index Name') for node, sorted_above in self.walk(plan)]
+        self.assertIn('tasks_ready_idx', index_names)
+
+    def test_pull_plan_uses_ready_index(self):
+        for count in [10000, 200000]:
+            self.grow_tasks(count)
+
+            self.assert_index_backed(['classifier-search'])
+            self.assert_index_backed(['classifier-search', 'cleanup-workers'])
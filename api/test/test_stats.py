@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APITestCase, APIClient
+
+from api.models import TaskDef, Task
+
+class QueueStatsTests(APITestCase):
+    def setUp(self):
+        self.task_def = TaskDef.objects.create(name='classifier-search', max_attempts=2)
+        TaskDef.objects.create(name='cleanup-workers')
+
+    def get_stats(self):
+        client = APIClient()
+
+        response = client.get('/stats/queues')
+        self.assertEqual(response.status_code, 200)
+
+        return {stats['task_def']: stats for stats in response.data}
+
+    def test_queue_stats(self):
+        now = timezone.now()
+        tasks = [Task.objects.create(task_def=self.task_def, run_at=now - timedelta(minutes=i), data={})
+                 for i in range(5)]
+        Task.objects.create(task_def=self.task_def, run_at=now + timedelta(hours=1), data={})
+        Task.objects.create(task_def=self.task_def, priority='high', run_at=now - timedelta(minutes=10), data={})
+
+        Task.objects.filter(id__in=[tasks[0].id, tasks[1].id]).update(status='in_progress', worker_id='foo')
+        Task.objects.filter(id=tasks[2].id).update(status='failed_retrying')
+        tasks[3].delete()
+
+        stats = self.get_stats()
+
+        self.assertEqual(stats['classifier-search']['statuses']['queued'], 3)
+        self.assertEqual(stats['classifier-search']['statuses']['in_progress'], 2)
+        self.assertEqual(stats['classifier-search']['statuses']['failed_retrying'], 1)
+        self.assertEqual(stats['classifier-search']['statuses']['failed'], 0)
+        self.assertEqual(stats['classifier-search']['in_flight'], 2)
+        self.assertEqual(stats['classifier-search']['oldest_ready_run_at'], now - timedelta(minutes=10))
+
+        self.assertEqual(stats['cleanup-workers']['statuses']['queued'], 0)
+        self.assertEqual(stats['cleanup-workers']['oldest_ready_run_at'], None)
+
+    def test_queue_stats_match_tasks(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO tasks (task_def_name, status, priority, priority_rank, run_at, attempts, created_at, updated_at)
+                SELECT
+                    CASE WHEN i % 3 = 0 THEN 'cleanup-workers' ELSE 'classifier-search' END,
+                    CASE WHEN i % 5 = 0 THEN 'completed' ELSE 'queued' END,
+                    'normal', 3, NOW(), 0, NOW(), NOW()
+                FROM generate_series(1, 3000) i;
+
+                UPDATE tasks SET status = 'dequeued' WHERE id % 7 = 0;
+                DELETE FROM tasks WHERE id % 11 = 0;
+            """)
+
+        stats = self.get_stats()
+
+        for task_def in ['classifier-search', 'cleanup-workers']:
+            for status in ['queued', 'completed', 'dequeued']:
+                count = Task.objects.filter(task_def=task_def, status=status).count()
+                self.assertEqual(stats[task_def]['statuses'][status], count)
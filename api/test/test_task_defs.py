@@ -6,6 +6,12 @@ class TaskDefTests(APITestCase):
                      'description',
                      'default_timeout',
                      'max_attempts',
+                     'weight',
+                     'max_concurrency',
+                     'retry_delay',
+                     'retry_backoff',
+                     'retry_jitter',
+                     'retry_max_delay',
                      'created_at',
                      'updated_at']
 
@@ -27,6 +33,9 @@ class TaskDefTests(APITestCase):
         self.assertEqual(response.data['description'], None)
         self.assertEqual(response.data['max_attempts'], 1)
         self.assertEqual(response.data['default_timeout'], 600)
+        self.assertEqual(response.data['weight'], 1)
+        self.assertEqual(response.data['max_concurrency'], None)
+        self.assertEqual(response.data['retry_delay'], 0)
 
     def test_create_task_def_auth(self):
         client = APIClient()
@@ -3,18 +3,23 @@ from unittest.mock import patch
 
 from rest_framework.test import APITestCase, APIClient
 
+from api.models import TaskDef, Task
+
 task_keys = ['id',
              'task_def',
              'status',
              'worker_id',
              'locked_at',
+             'lease_expires_at',
              'priority',
              'unique',
              'run_at',
+             'timeout',
              'started_at',
              'completed_at',
              'failed_at',
              'data',
+             'data_digest',
              'attempts',
              'created_at',
              'updated_at']
@@ -197,6 +202,82 @@ class TaskTests(APITestCase):
         self.assertEqual(list(list_response.data['results'][0].keys()), task_keys)
         self.assertEqual(list(list_response.data['results'][1].keys()), task_keys)
 
+    def walk_pages(self, client, url):
+        ids = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [task['id'] for task in response.data['results']]
+            url = response.data['next']
+        return ids, response
+
+    def test_list_tasks_pages(self):
+        task_def = TaskDef.objects.get(name=self.task_def_name)
+        completed_ats = [datetime(2016, 7, 14, 1, tzinfo=timezone.utc),
+                         None,
+                         datetime(2016, 7, 14, 3, tzinfo=timezone.utc),
+                         datetime(2016, 7, 14, 1, tzinfo=timezone.utc),
+                         None,
+                         datetime(2016, 7, 14, 2, tzinfo=timezone.utc),
+                         datetime(2016, 7, 14, 1, tzinfo=timezone.utc)]
+        tasks = [Task.objects.create(task_def=task_def, completed_at=completed_at, data={})
+                 for completed_at in completed_ats]
+
+        client = APIClient()
+
+        ids, last_response = self.walk_pages(client, '/tasks?limit=3')
+        self.assertEqual(ids, [task.id for task in tasks])
+
+        # NULLs sort last ascending, first descending
+        ascending = sorted(tasks, key=lambda task: (task.completed_at is None, task.completed_at or 0, task.id))
+        ids, last_response = self.walk_pages(client, '/tasks?limit=2&ordering=completed_at')
+        self.assertEqual(ids, [task.id for task in ascending])
+
+        descending = list(reversed(ascending))
+        ids, last_response = self.walk_pages(client, '/tasks?limit=2&ordering=-completed_at')
+        self.assertEqual(ids, [task.id for task in descending])
+
+        # and back again
+        ids = []
+        url = last_response.data['previous']
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids = [task['id'] for task in response.data['results']] + ids
+            url = response.data['previous']
+        self.assertEqual(ids, [task.id for task in descending[:6]])
+
+    def test_list_tasks_count(self):
+        task_def = TaskDef.objects.get(name=self.task_def_name)
+        for i in range(3):
+            Task.objects.create(task_def=task_def, data={})
+
+        client = APIClient()
+
+        response = client.get('/tasks?limit=1')
+        self.assertEqual(response.data['count'], None)
+
+        response = client.get('/tasks?limit=1&count=exact')
+        self.assertEqual(response.data['count'], 3)
+
+        response = client.get('/tasks?limit=1&count=estimate')
+        self.assertIsInstance(response.data['count'], int)
+
+    def test_list_tasks_paging_validation(self):
+        client = APIClient()
+
+        response = client.get('/tasks?ordering=data')
+        self.assertEqual(response.status_code, 400)
+
+        response = client.get('/tasks?limit=1001')
+        self.assertEqual(response.status_code, 400)
+
+        response = client.get('/tasks?count=all')
+        self.assertEqual(response.status_code, 400)
+
+        response = client.get('/tasks?cursor=foo')
+        self.assertEqual(response.status_code, 400)
+
     def test_get_task(self):
         task_post_data = {
             'task_def': self.task_def_name,
@@ -219,3 +300,38 @@ class TaskTests(APITestCase):
 
         self.assertEqual(task_response.status_code, 200)
         self.assertEqual(list(task_response.data.keys()), task_keys)
+
+    def test_sparse_fieldsets(self):
+        task_def = TaskDef.objects.get(name=self.task_def_name)
+        for i in range(3):
+            Task.objects.create(task_def=task_def,
+                                run_at=datetime(2016, 7, 14, tzinfo=timezone.utc),
+                                data={'foo': 'bar'})
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token)
+
+        response = client.get('/tasks?fields=id,status,task_def&ordering=-created_at&limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data['results'][0].keys()), ['id', 'task_def', 'status'])
+
+        response = client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+
+        response = client.get('/tasks?exclude=data,data_digest')
+        self.assertEqual(list(response.data['results'][0].keys()),
+                         [key for key in task_keys if key not in ['data', 'data_digest']])
+
+        id = str(response.data['results'][0]['id'])
+
+        response = client.get('/tasks/' + id + '?fields=id,data')
+        self.assertEqual(response.data, {'id': int(id), 'data': {'foo': 'bar'}})
+
+        response = client.get('/tasks/queue?tasks=' + self.task_def_name + '&worker_id=foo&exclude=data')
+        self.assertEqual(list(response.data[0].keys()), [key for key in task_keys if key != 'data'])
+
+        response = client.get('/tasks?fields=id,foo')
+        self.assertEqual(response.status_code, 400)
+
+        response = client.get('/tasks?fields=id&exclude=data')
+        self.assertEqual(response.status_code, 400)
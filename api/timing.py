@@ -0,0 +1,38 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+local = threading.local()
+
+class RequestTimer(object):
+    """Time spent in named parts of one request, in seconds"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = OrderedDict()
+        self.view = None
+        self.render_start = None
+        self.query_logs = {} # connection alias -> (force_debug_cursor before, queries_log length)
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0) + seconds
+
+def current():
+    """The timer of the request being handled by this thread, if it's sampled"""
+    return getattr(local, 'timer', None)
+
+@contextmanager
+def span(name):
+    """Adds the time spent in the block to the current request's `name` span.
+    Does nothing if the request isn't sampled."""
+    timer = current()
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
@@ -0,0 +1,361 @@
+import json
+
+from django.conf import settings
+from django.db import connection
+from rest_framework import exceptions
+
+from api import payloads
+from api.prepared import PreparedStatement
+
+class TaskStateConflict(exceptions.APIException):
+    status_code = 409
+    default_detail = 'Task state conflict'
+
+# Single task transitions are compare-and-set: the UPDATE only matches if the task
+# is in one of the expected statuses, and held by `worker_id` if one is given.
+# The outer SELECT reads `tasks` from the statement's snapshot, so a task that
+# wasn't updated still reports the status and worker that blocked it.
+touch_task_sql = """
+WITH updated as (
+    UPDATE tasks SET
+        lease_expires_at = NOW() + INTERVAL '1 second' * COALESCE(%(timeout)s, tasks.timeout, task_defs.default_timeout),
+        updated_at = NOW()
+    FROM task_defs
+    WHERE
+        tasks.id = %(id)s
+        AND task_defs.name = tasks.task_def_name
+        AND status = 'in_progress'
+        AND (%(worker_id)s IS NULL OR worker_id = %(worker_id)s)
+    RETURNING tasks.id
+)
+SELECT updated.id, tasks.status, tasks.worker_id
+FROM tasks
+LEFT JOIN updated ON true
+WHERE tasks.id = %(id)s;
+"""
+
+release_task_sql = """
+WITH updated as (
+    UPDATE tasks SET
+        status = 'queued',
+        locked_at = NULL,
+        lease_expires_at = NULL,
+        worker_id = NULL,
+        updated_at = NOW()
+    WHERE
+        id = %(id)s
+        AND status = 'in_progress'
+        AND (%(worker_id)s IS NULL OR worker_id = %(worker_id)s)
+    RETURNING id
+)
+SELECT updated.id, tasks.status, tasks.worker_id
+FROM tasks
+LEFT JOIN updated ON true
+WHERE tasks.id = %(id)s;
+"""
+
+dequeue_task_sql = """
+WITH updated as (
+    UPDATE tasks SET
+        status = 'dequeued',
+        locked_at = NULL,
+        lease_expires_at = NULL,
+        worker_id = NULL,
+        updated_at = NOW()
+    WHERE
+        id = %(id)s
+        AND status IN ('scheduled', 'queued', 'in_progress', 'failed_retrying')
+        AND (%(worker_id)s IS NULL OR worker_id = %(worker_id)s)
+    RETURNING id
+)
+SELECT updated.id, tasks.status, tasks.worker_id
+FROM tasks
+LEFT JOIN updated ON true
+WHERE tasks.id = %(id)s;
+"""
+
+
+# Lease extensions only apply to tasks the worker still holds. A task that was
+# reclaimed after its lease ran out, or released, simply isn't returned.
+touch_tasks_sql = """
+UPDATE tasks SET
+    lease_expires_at = NOW() + INTERVAL '1 second' * COALESCE(%(timeout)s, tasks.timeout, task_defs.default_timeout),
+    updated_at = NOW()
+FROM task_defs
+WHERE
+    tasks.id = ANY(%(ids)s)
+    AND status = 'in_progress'
+    AND worker_id = %(worker_id)s
+    AND task_defs.name = tasks.task_def_name
+RETURNING tasks.id;
+"""
+
+touch_worker_tasks_sql = """
+UPDATE tasks SET
+    lease_expires_at = NOW() + INTERVAL '1 second' * COALESCE(%(timeout)s, tasks.timeout, task_defs.default_timeout),
+    updated_at = NOW()
+FROM task_defs
+WHERE
+    status = 'in_progress'
+    AND worker_id = %(worker_id)s
+    AND task_defs.name = tasks.task_def_name
+RETURNING tasks.id;
+"""
+
+# Finishes a batch of tasks in one statement, deciding between failed and
+# failed_retrying from each task's attempts. A retry's run_at is pushed back by
+# the task def's retry policy, see TaskDef.retry_delay_seconds, whose exponent
+# stops at the attempt that reaches retry_max_delay. Only tasks still in
+# progress, and held by the given worker if one is given, are updated. The
+# outer SELECT reads `tasks` from the statement's snapshot, so it sees whether
+# a task that wasn't updated exists at all.
+ack_tasks_sql = """
+WITH acks as (
+    SELECT *
+    FROM jsonb_to_recordset(%(acks)s::jsonb) AS acks(id integer, worker_id varchar, completed_at timestamptz,
+                                              failed_at timestamptz, data jsonb, data_digest varchar,
+                                              has_data boolean)
+),
+acked as (
+    UPDATE tasks SET
+        status =
+            CASE WHEN acks.completed_at IS NOT NULL
+                 THEN 'completed'
+                 WHEN tasks.attempts >= task_defs.max_attempts
+                 THEN 'failed'
+                 ELSE 'failed_retrying'
+            END,
+        completed_at = acks.completed_at,
+        failed_at = acks.failed_at,
+        data =
+            CASE WHEN acks.has_data
+                 THEN acks.data
+                 ELSE tasks.data
+            END,
+        data_digest =
+            CASE WHEN acks.has_data
+                 THEN acks.data_digest
+                 ELSE tasks.data_digest
+            END,
+        run_at =
+            CASE WHEN acks.completed_at IS NULL
+                      AND tasks.attempts < task_defs.max_attempts
+                      AND task_defs.retry_delay > 0
+                 THEN NOW() + INTERVAL '1 second' * LEAST(task_defs.retry_max_delay,
+                                                          task_defs.retry_delay * power(task_defs.retry_backoff, LEAST(
+                                                              tasks.attempts - 1,
+                                                              CASE WHEN task_defs.retry_backoff > 1
+                                                                   THEN ceil(ln(GREATEST(task_defs.retry_max_delay,
+                                                                                         task_defs.retry_delay)::float
+                                                                                / task_defs.retry_delay)
+                                                                             / ln(task_defs.retry_backoff))
+                                                                   ELSE 0
+                                                              END)))
+                                                  * (1 - task_defs.retry_jitter * random())
+                 ELSE tasks.run_at
+            END,
+        updated_at = NOW()
+    FROM acks, task_defs
+    WHERE
+        tasks.id = acks.id
+        AND task_defs.name = tasks.task_def_name
+        AND tasks.status = 'in_progress'
+        AND (acks.worker_id IS NULL OR tasks.worker_id = acks.worker_id)
+    RETURNING tasks.id, tasks.status
+)
+SELECT acks.id, acked.status, tasks.id IS NOT NULL
+FROM acks
+LEFT JOIN acked ON acked.id = acks.id
+LEFT JOIN tasks ON tasks.id = acks.id;
+"""
+
+# Workers run these on every task, so they're prepared once per connection
+touch_task_statement = PreparedStatement('touch_task', touch_task_sql,
+                                         [('id', 'integer'), ('timeout', 'integer'), ('worker_id', 'varchar')])
+release_task_statement = PreparedStatement('release_task', release_task_sql,
+                                           [('id', 'integer'), ('worker_id', 'varchar')])
+dequeue_task_statement = PreparedStatement('dequeue_task', dequeue_task_sql,
+                                           [('id', 'integer'), ('worker_id', 'varchar')])
+touch_tasks_statement = PreparedStatement('touch_tasks', touch_tasks_sql,
+                                          [('ids', 'integer[]'), ('timeout', 'integer'), ('worker_id', 'varchar')])
+touch_worker_tasks_statement = PreparedStatement('touch_worker_tasks', touch_worker_tasks_sql,
+                                                 [('timeout', 'integer'), ('worker_id', 'varchar')])
+ack_tasks_statement = PreparedStatement('ack_tasks', ack_tasks_sql, [('acks', 'jsonb')])
+
+# Puts tasks whose lease ran out back in the queue, oldest deadline first. The
+# worker that held them loses the lease, so its later touches and acks fail.
+# The pull counted an attempt that never reported back, so it's given back,
+# only failures acked by a worker use up attempts.
+reclaim_expired_leases_sql = """
+WITH expired as (
+    SELECT id
+    FROM tasks
+    WHERE
+        status = 'in_progress'
+        AND lease_expires_at < NOW()
+    ORDER BY lease_expires_at
+    LIMIT %(batch_size)s
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE tasks SET
+    status = 'queued',
+    worker_id = NULL,
+    locked_at = NULL,
+    lease_expires_at = NULL,
+    attempts = GREATEST(tasks.attempts - 1, 0),
+    updated_at = NOW()
+FROM expired
+WHERE tasks.id = expired.id
+RETURNING tasks.id;
+"""
+
+# Puts failed tasks with attempts left back in the queue. A task def's
+# max_attempts may have been lowered since the task failed, so tasks that are now
+# out of attempts are failed instead, and retries backed off beyond the horizon
+# are scheduled.
+requeue_retries_sql = """
+WITH retrying as (
+    SELECT tasks.id, tasks.attempts < task_defs.max_attempts AS can_retry
+    FROM tasks
+    JOIN task_defs
+    ON tasks.task_def_name = task_defs.name
+    WHERE
+        tasks.status = 'failed_retrying'
+    ORDER BY tasks.run_at
+    LIMIT %(batch_size)s
+    FOR UPDATE OF tasks SKIP LOCKED
+)
+UPDATE tasks SET
+    status =
+        CASE WHEN NOT retrying.can_retry
+             THEN 'failed'
+             WHEN tasks.run_at > NOW() + INTERVAL '1 second' * %(horizon)s
+             THEN 'scheduled'
+             ELSE 'queued'
+        END,
+    worker_id = NULL,
+    locked_at = NULL,
+    lease_expires_at = NULL,
+    updated_at = NOW()
+FROM retrying
+WHERE tasks.id = retrying.id
+RETURNING tasks.status;
+"""
+
+# Moves scheduled tasks into the queue once they're due within the horizon,
+# soonest first. They still aren't pulled before their run_at, promoting them
+# early means a maintainer pass that runs late doesn't hold them up.
+promote_scheduled_sql = """
+WITH due as (
+    SELECT id
+    FROM tasks
+    WHERE
+        status = 'scheduled'
+        AND run_at <= NOW() + INTERVAL '1 second' * %(horizon)s
+    ORDER BY run_at
+    LIMIT %(batch_size)s
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE tasks SET
+    status = 'queued',
+    updated_at = NOW()
+FROM due
+WHERE tasks.id = due.id;
+"""
+
+def touch_tasks(worker_id, timeout=None, ids=None):
+    """Extends the leases `worker_id` holds by `timeout` seconds, or by each task's
+    own timeout, either on the tasks in `ids` or on all of them. Returns (touched
+    ids, lost ids), where lost ids are those in `ids` the worker no longer holds."""
+    params = {'worker_id': worker_id, 'timeout': timeout, 'ids': ids}
+
+    with connection.cursor() as cursor:
+        if ids == None:
+            touch_worker_tasks_statement.execute(cursor, params)
+        else:
+            touch_tasks_statement.execute(cursor, params)
+        touched = sorted(row[0] for row in cursor.fetchall())
+
+    if ids == None:
+        return touched, []
+
+    touched_ids = set(touched)
+    lost = [id for id in ids if id not in touched_ids]
+
+    return touched, lost
+
+def ack_tasks(acks):
+    """Completes or fails a list of validated acks (`id`, `completed_at` or
+    `failed_at`, and optionally `data` and `worker_id`). Returns a dict of task
+    id to (new status, found), where the status is None if the task wasn't
+    updated because it isn't in progress or is held by another worker."""
+    offloaded = payloads.offload_many([ack.get('data', None) for ack in acks])
+
+    rows = []
+    for ack, (data, data_digest) in zip(acks, offloaded):
+        completed_at = ack.get('completed_at', None)
+        failed_at = ack.get('failed_at', None)
+        rows.append({
+            'id': ack['id'],
+            'worker_id': ack.get('worker_id', None),
+            'completed_at': None if completed_at == None else completed_at.isoformat(),
+            'failed_at': None if failed_at == None else failed_at.isoformat(),
+            'data': data,
+            'data_digest': data_digest,
+            'has_data': 'data' in ack
+        })
+
+    with connection.cursor() as cursor:
+        ack_tasks_statement.execute(cursor, {'acks': json.dumps(rows)})
+        results = cursor.fetchall()
+
+    return dict((id, (status, found)) for id, status, found in results)
+
+def transition_task(statement, params):
+    with connection.cursor() as cursor:
+        statement.execute(cursor, params)
+        row = cursor.fetchone()
+
+    if row == None:
+        raise exceptions.NotFound('Task not found')
+
+    updated_id, status, worker_id = row
+
+    if updated_id == None:
+        if params['worker_id'] != None and worker_id != params['worker_id']:
+            raise TaskStateConflict('Task is not held by worker "{}"'.format(params['worker_id']))
+        raise TaskStateConflict('Task status is "{}"'.format(status))
+
+def touch_task(id, timeout=None, worker_id=None):
+    transition_task(touch_task_statement, {'id': id, 'timeout': timeout, 'worker_id': worker_id})
+
+def release_task(id, worker_id=None):
+    transition_task(release_task_statement, {'id': id, 'worker_id': worker_id})
+
+def dequeue_task(id, worker_id=None):
+    transition_task(dequeue_task_statement, {'id': id, 'worker_id': worker_id})
+
+def reclaim_expired_leases(batch_size=1000):
+    """Requeues up to `batch_size` tasks whose lease ran out. Returns the count."""
+    with connection.cursor() as cursor:
+        cursor.execute(reclaim_expired_leases_sql, {'batch_size': batch_size})
+        return cursor.rowcount
+
+def requeue_retries(batch_size=1000):
+    """Requeues up to `batch_size` failed_retrying tasks. Returns (requeued count,
+    failed count), where requeued includes retries that were scheduled."""
+    with connection.cursor() as cursor:
+        cursor.execute(requeue_retries_sql, {'batch_size': batch_size,
+                                             'horizon': settings.SCHEDULED_TASK_HORIZON})
+        statuses = [row[0] for row in cursor.fetchall()]
+
+    failed = statuses.count('failed')
+    return len(statuses) - failed, failed
+
+def promote_scheduled(batch_size=1000):
+    """Queues up to `batch_size` scheduled tasks that are due within
+    SCHEDULED_TASK_HORIZON seconds. Returns the count."""
+    with connection.cursor() as cursor:
+        cursor.execute(promote_scheduled_sql, {'batch_size': batch_size,
+                                               'horizon': settings.SCHEDULED_TASK_HORIZON})
+        return cursor.rowcount
@@ -1,17 +1,47 @@
-import datetime
+from collections import OrderedDict
 
 import django_filters
+from django.http import HttpResponse
 from rest_framework import filters
 from rest_framework import generics
 from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.exceptions import ParseError, NotFound
 
-from api.models import TaskDef, Task
-from api.serializers import TaskDefSerializer, TaskSerializer
-from api import queue
+from api.models import TaskDef, Task, Schedule
+from api.serializers import (TaskDefSerializer, TaskSerializer, BulkTaskSerializer, AckTaskSerializer,
+                             TouchTasksSerializer, ScheduleSerializer)
+from api.parsers import NDJSONParser, MessagePackParser
+from api import queue, transitions, stats, metrics, encoders, payloads, timing
 from api.auth import TaskServicePermission, QueuePullPermission
 
+def encoded_list(view, encode, keys=None):
+    """Lists dict rows through `encode` instead of the view's serializer. `keys`
+    limits the columns selected, the primary key and ordering field are added
+    for pagination."""
+    queryset = view.filter_queryset(view.get_queryset())
+
+    if keys == None:
+        queryset = queryset.values()
+    else:
+        ordering = view.request.query_params.get('ordering', None) or view.ordering[0]
+        ordering = ordering.lstrip('-')
+        extra_keys = [queryset.model._meta.pk.attname]
+        if ordering in view.ordering_fields:
+            extra_keys.append(queryset.model._meta.get_field(ordering).attname)
+        queryset = queryset.values(*(list(keys) + [key for key in extra_keys if key not in keys]))
+
+    page = view.paginate_queryset(queryset)
+    if page is None:
+        page = list(queryset)
+        with timing.span('serialize'):
+            return Response([encode(row) for row in page])
+
+    with timing.span('serialize'):
+        results = [encode(row) for row in page]
+    return view.get_paginated_response(results)
+
 # TaskDef
 
 class TaskDefFilter(filters.FilterSet):
@@ -34,6 +64,9 @@ class TaskDefList(generics.ListCreateAPIView):
     ordering_fields = ('name','created_at','updated_at')
     ordering = ('name',)
 
+    def list(self, request, *args, **kwargs):
+        return encoded_list(self, encoders.encode_task_def_values)
+
 class TaskDefRetrieveUpdate(generics.RetrieveUpdateAPIView):
     permission_classes = (TaskServicePermission,)
     queryset = TaskDef.objects.all()
@@ -42,6 +75,28 @@ class TaskDefRetrieveUpdate(generics.RetrieveUpdateAPIView):
 
 # Task
 
+def get_task_fields(request):
+    """Task fields to return, limited by the `fields` or `exclude` query parameter,
+    each a comma separated list of field names"""
+    if 'fields' in request.query_params and 'exclude' in request.query_params:
+        raise ParseError('`fields` and `exclude` cannot be used together')
+
+    if 'fields' in request.query_params:
+        selected = request.query_params['fields'].split(',')
+    elif 'exclude' in request.query_params:
+        selected = request.query_params['exclude'].split(',')
+    else:
+        return encoders.TASK_FIELD_NAMES
+
+    unknown = [name for name in selected if name not in encoders.TASK_FIELD_NAMES]
+    if unknown:
+        raise ParseError('Unknown task fields `{}`'.format('`, `'.join(unknown)))
+
+    if 'fields' in request.query_params:
+        return tuple(name for name in encoders.TASK_FIELD_NAMES if name in selected)
+
+    return tuple(name for name in encoders.TASK_FIELD_NAMES if name not in selected)
+
 class TaskFilter(filters.FilterSet):
     created_at__gte = django_filters.IsoDateTimeFilter(name='created_at', lookup_expr='gte')
     created_at__lte = django_filters.IsoDateTimeFilter(name='created_at', lookup_expr='lte')
@@ -52,6 +107,9 @@ class TaskFilter(filters.FilterSet):
     locked_at__gte = django_filters.IsoDateTimeFilter(name='locked_at', lookup_expr='gte')
     locked_at__lte = django_filters.IsoDateTimeFilter(name='locked_at', lookup_expr='lte')
 
+    lease_expires_at__gte = django_filters.IsoDateTimeFilter(name='lease_expires_at', lookup_expr='gte')
+    lease_expires_at__lte = django_filters.IsoDateTimeFilter(name='lease_expires_at', lookup_expr='lte')
+
     run_at__gte = django_filters.IsoDateTimeFilter(name='run_at', lookup_expr='gte')
     run_at__lte = django_filters.IsoDateTimeFilter(name='run_at', lookup_expr='lte')
 
@@ -71,6 +129,7 @@ class TaskFilter(filters.FilterSet):
                   'status',
                   'worker_id',
                   'locked_at',
+                  'lease_expires_at',
                   'priority',
                   'unique',
                   'run_at',
@@ -87,8 +146,9 @@ class TaskList(generics.ListCreateAPIView):
     serializer_class = TaskSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = TaskFilter
-    ordering_fields = ('name',
+    ordering_fields = ('id',
                        'locked_at',
+                       'lease_expires_at',
                        'run_at',
                        'started_at',
                        'completed_at',
@@ -98,12 +158,82 @@ class TaskList(generics.ListCreateAPIView):
                        'updated_at')
     ordering = ('id',)
 
+    def list(self, request, *args, **kwargs):
+        names = get_task_fields(request)
+        if names == encoders.TASK_FIELD_NAMES:
+            return encoded_list(self, encoders.encode_task_values)
+
+        return encoded_list(self,
+                            encoders.task_encoder(names, 'task_def_id'),
+                            encoders.task_keys(names, 'task_def_id'))
+
+class BulkTaskCreate(APIView):
+    permission_classes = (TaskServicePermission,)
+    parser_classes = (JSONParser, NDJSONParser, MessagePackParser)
+
+    max_tasks = 50000
+
+    def post(self, request, format=None):
+        if not isinstance(request.data, list):
+            raise ParseError('Expected a list of tasks')
+
+        if len(request.data) > self.max_tasks:
+            raise ParseError('No more than {} tasks can be queued at once'.format(self.max_tasks))
+
+        serializer = BulkTaskSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        return Response(results, status=201)
+
 class TaskRetrieveUpdate(generics.RetrieveUpdateAPIView):
     permission_classes = (TaskServicePermission,)
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
     lookup_field = 'id'
 
+    def retrieve(self, request, id, *args, **kwargs):
+        names = get_task_fields(request)
+
+        row = self.get_queryset().filter(id=id).values(*encoders.task_keys(names, 'task_def_id')).first()
+        if row == None:
+            raise NotFound()
+
+        with timing.span('serialize'):
+            return Response(encoders.task_encoder(names, 'task_def_id')(row))
+
+    def update(self, request, *args, **kwargs):
+        names = get_task_fields(request)
+
+        response = super(TaskRetrieveUpdate, self).update(request, *args, **kwargs)
+        if names != encoders.TASK_FIELD_NAMES:
+            response.data = OrderedDict((name, value) for name, value in response.data.items() if name in names)
+
+        return response
+
+class TaskData(APIView):
+    permission_classes = (TaskServicePermission,)
+
+    def get(self, request, id, format=None):
+        task = Task.objects.filter(id=id).values('data', 'data_digest').first()
+        if task == None:
+            raise NotFound('Task not found')
+
+        if task['data_digest'] == None:
+            return Response(task['data'])
+
+        ## offloaded data is content addressed, so the digest is a strong ETag
+        etag = '"{}"'.format(task['data_digest'])
+        if request.META.get('HTTP_IF_NONE_MATCH', None) == etag:
+            response = HttpResponse(status=304)
+        else:
+            data = payloads.load(task['data_digest'])
+            if data == None:
+                raise payloads.PayloadMissing()
+            response = HttpResponse(data, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
 class PullQueue(APIView):
     permission_classes = (QueuePullPermission,)
 
@@ -125,55 +255,98 @@ class PullQueue(APIView):
         if limit < 1 or limit > 10:
             raise ParseError('`limit` must be between 1 and 10')
 
-        raw_tasks = queue.get_tasks(request.query_params.getlist('tasks'),
-                                    request.query_params['worker_id'],
-                                    limit)
+        if 'wait' in request.query_params:
+            try:
+                wait = int(request.query_params['wait'])
+            except ValueError:
+                raise ParseError('`wait` query parameter must be an integer')
+        else:
+            wait = 0
 
-        tasks = []
-        for task in raw_tasks:
-            serializer = TaskSerializer(task)
-            tasks.append(serializer.data)
+        if wait < 0 or wait > 60:
+            raise ParseError('`wait` must be between 0 and 60 seconds')
+
+        fair = request.query_params.get('fair', 'false')
+        if fair not in ('true', 'false'):
+            raise ParseError('`fair` must be `true` or `false`')
+
+        names = get_task_fields(request)
+        if names == encoders.TASK_FIELD_NAMES:
+            columns = None
+            encode = encoders.encode_task_row
+        else:
+            columns = encoders.task_keys(names, 'task_def_name')
+            encode = encoders.task_encoder(names, 'task_def_name')
+
+        with metrics.REQUEST_SECONDS.labels('pull').time():
+            raw_tasks = queue.get_tasks(request.query_params.getlist('tasks'),
+                                        request.query_params['worker_id'],
+                                        limit,
+                                        wait,
+                                        columns,
+                                        fair == 'true')
+
+            with timing.span('serialize'):
+                tasks = [encode(task) for task in raw_tasks]
 
         return Response(tasks)
 
+def get_touch_timeout(request):
+    if 'timeout' in request.query_params:
+        try:
+            timeout = int(request.query_params['timeout'])
+        except ValueError:
+            raise ParseError('`timeout` query parameter must be an integer')
+    else:
+        return None ## the task's own timeout, or its task def's default
+
+    if not 0 < timeout < 86400:
+        raise ParseError('`timeout` must be between 0 and 86,400 seconds (1 day)')
+
+    return timeout
+
+def get_worker_id(request):
+    """Optional `worker_id`, which makes a task transition conditional on the
+    worker still holding the task"""
+    return request.query_params.get('worker_id', None)
+
 class TouchTask(APIView):
     permission_classes = (TaskServicePermission,)
 
     def post(self, request, id):
-        if 'timeout' in request.query_params:
-            try:
-                timeout = int(request.query_params['timeout'])
-            except ValueError:
-                raise ParseError('`timeout` query parameter must be an integer')
-        else:
-            timeout = 600
+        timeout = get_touch_timeout(request)
 
-        if not 0 < timeout < 86400:
-            raise ParseError('`timeout` must be between 0 and 86,400 seconds (1 day)')
+        with metrics.transition('touch'):
+            transitions.touch_task(id, timeout, get_worker_id(request))
 
-        try:
-            task = Task.objects.get(id=id)
-        except Task.DoesNotExist:
-            raise NotFound('Task not found')
+        return Response(status=204)
 
-        task.locked_at = (datetime.datetime.now() + datetime.timedelta(seconds=timeout)).isoformat() + 'Z'
-        task.save()
+class TouchWorkerTasks(APIView):
+    permission_classes = (TaskServicePermission,)
 
-        return Response(status=204)
+    def post(self, request, worker_id):
+        timeout = get_touch_timeout(request)
+
+        serializer = TouchTasksSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        ## no ids, or an empty form body, touches everything the worker holds
+        ids = serializer.validated_data.get('ids', None) or None
+
+        with metrics.REQUEST_SECONDS.labels('worker_touch').time():
+            touched, lost = transitions.touch_tasks(worker_id, timeout, ids)
+
+        metrics.TRANSITIONS.labels('worker_touch', 'ok').inc(len(touched))
+        metrics.TRANSITIONS.labels('worker_touch', 'lost').inc(len(lost))
+
+        return Response({'touched': touched, 'lost': lost})
 
 class ReleaseTask(APIView):
     permission_classes = (TaskServicePermission,)
 
     def post(self, request, id):
-        try:
-            task = Task.objects.get(id=id)
-        except Task.DoesNotExist:
-            raise NotFound('Task not found')
-
-        task.status = 'queued'
-        task.locked_at = None
-        task.worker_id = None
-        task.save()
+        with metrics.transition('release'):
+            transitions.release_task(id, get_worker_id(request))
 
         return Response(status=204)
 
@@ -181,14 +354,62 @@ class DequeueTask(APIView):
     permission_classes = (TaskServicePermission,)
 
     def post(self, request, id):
-        try:
-            task = Task.objects.get(id=id)
-        except Task.DoesNotExist:
-            raise NotFound('Task not found')
-
-        task.status = 'dequeued'
-        task.locked_at = None
-        task.worker_id = None
-        task.save()
+        with metrics.transition('dequeue'):
+            transitions.dequeue_task(id, get_worker_id(request))
 
         return Response(status=204)
+
+class AckTasks(APIView):
+    permission_classes = (TaskServicePermission,)
+
+    max_acks = 1000
+
+    def post(self, request, format=None):
+        if not isinstance(request.data, list):
+            raise ParseError('Expected a list of task acknowledgements')
+
+        if len(request.data) > self.max_acks:
+            raise ParseError('No more than {} tasks can be acknowledged at once'.format(self.max_acks))
+
+        serializer = AckTaskSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        return Response(results)
+
+# Schedule
+
+class ScheduleFilter(filters.FilterSet):
+    next_run_at__gte = django_filters.IsoDateTimeFilter(name='next_run_at', lookup_expr='gte')
+    next_run_at__lte = django_filters.IsoDateTimeFilter(name='next_run_at', lookup_expr='lte')
+
+    class Meta:
+        model = Schedule
+        fields = ['id', 'task_def', 'enabled', 'next_run_at']
+
+class ScheduleList(generics.ListCreateAPIView):
+    permission_classes = (TaskServicePermission,)
+    queryset = Schedule.objects.all()
+    serializer_class = ScheduleSerializer
+    filter_backends = (filters.DjangoFilterBackend,)
+    filter_class = ScheduleFilter
+    ordering_fields = ('id', 'next_run_at', 'last_run_at', 'created_at', 'updated_at')
+    ordering = ('id',)
+
+class ScheduleRetrieveUpdateDestroy(generics.RetrieveUpdateDestroyAPIView):
+    permission_classes = (TaskServicePermission,)
+    queryset = Schedule.objects.all()
+    serializer_class = ScheduleSerializer
+    lookup_field = 'id'
+
+# Stats
+
+class QueueStats(APIView):
+    permission_classes = (TaskServicePermission,)
+
+    def get(self, request, format=None):
+        return Response(stats.queue_stats())
+
+def prometheus_metrics(request):
+    content, content_type = metrics.render()
+    return HttpResponse(content, content_type=content_type)
@@ -0,0 +1,70 @@
+"""Latency of a queue pull behind a backlog of tasks due tomorrow, with the
+backlog queued, as it was before the `scheduled` status, and scheduled. The
+backlog is high priority, so pulls of the normal priority ready tasks have to
+get past it in the ready index. Runs against the configured database, which
+must be migrated, and deletes its tasks afterwards.
+
+    DB_HOST=localhost python -m benchmarks.delayed [pulls] [backlog]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'task_service.settings')
+
+import django
+django.setup()
+
+from django.db import connection
+from django.test import override_settings
+
+from api import queue
+from api.models import TaskDef, Task
+
+TASK_DEF = 'benchmark-delayed'
+
+def cleanup():
+    Task.objects.filter(task_def_id=TASK_DEF).delete()
+
+def run(pulls, backlog, horizon):
+    cleanup()
+
+    run_at = datetime.now(timezone.utc) + timedelta(days=1)
+    with override_settings(SCHEDULED_TASK_HORIZON=horizon):
+        for start in range(0, backlog, 1000):
+            queue.enqueue_tasks([{'task_def': TASK_DEF, 'priority': 'high', 'run_at': run_at}
+                                 for n in range(start, min(backlog, start + 1000))])
+
+    ready_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    for start in range(0, pulls, 1000):
+        queue.enqueue_tasks([{'task_def': TASK_DEF, 'run_at': ready_at}
+                             for n in range(start, min(pulls, start + 1000))])
+
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM ANALYZE tasks')
+
+    timings = []
+    for i in range(pulls):
+        start = time.perf_counter()
+        tasks = queue.pull_tasks([TASK_DEF], 'benchmark-worker', 1, ['id'])
+        timings.append(time.perf_counter() - start)
+        assert len(tasks) == 1
+
+    timings.sort()
+    return (sum(timings) / len(timings) * 1000000,
+            timings[len(timings) // 2] * 1000000,
+            timings[int(len(timings) * 0.99)] * 1000000)
+
+if __name__ == '__main__':
+    pulls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    backlog = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    TaskDef.objects.get_or_create(name=TASK_DEF)
+    print('{:<10} {:>10} {:>10} {:>10}'.format('backlog', 'mean us', 'p50 us', 'p99 us'))
+    try:
+        for name, horizon in [('queued', 10 ** 9), ('scheduled', 60)]:
+            print('{:<10} {:>10.1f} {:>10.1f} {:>10.1f}'.format(name, *run(pulls, backlog, horizon)))
+    finally:
+        cleanup()
+        TaskDef.objects.filter(name=TASK_DEF).delete()
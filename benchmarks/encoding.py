@@ -0,0 +1,79 @@
+"""Encode and decode cost, and size, of JSON and MessagePack, with and
+without gzip, for a 100 task list page and a 10 task pull
+
+    python -m benchmarks.encoding [iterations]
+"""
+import gzip
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'task_service.settings')
+
+import django
+django.setup()
+
+import msgpack
+from rest_framework.renderers import JSONRenderer
+
+from api import encoders
+from api.renderers import MessagePackRenderer
+
+def task_rows(count):
+    now = datetime(2016, 7, 14, 0, 57, 51, 123456, tzinfo=timezone.utc)
+    return [{
+        'id': 238 + i,
+        'task_def_name': 'classifier_search',
+        'status': 'in_progress',
+        'worker_id': 'worker-{}'.format(i % 8),
+        'locked_at': now,
+        'lease_expires_at': now + timedelta(minutes=10),
+        'priority': 'normal',
+        'unique': 'cookie-user-32323-geneset-{}'.format(i),
+        'run_at': now - timedelta(seconds=i),
+        'timeout': None,
+        'started_at': now,
+        'completed_at': None,
+        'failed_at': None,
+        'data': {'algorithm': 'svm', 'genes': list(range(7000, 7050)), 'disease_types': ['BRCA', 'LUAD']},
+        'data_digest': None,
+        'attempts': 1,
+        'created_at': now - timedelta(hours=1),
+        'updated_at': now
+    } for i in range(count)]
+
+def formats():
+    json_renderer = JSONRenderer()
+    msgpack_renderer = MessagePackRenderer()
+
+    return [
+        ('json', json_renderer.render, lambda content: json.loads(content.decode('utf-8'))),
+        ('json+gzip',
+         lambda data: gzip.compress(json_renderer.render(data), 6),
+         lambda content: json.loads(gzip.decompress(content).decode('utf-8'))),
+        ('msgpack', msgpack_renderer.render, lambda content: msgpack.unpackb(content, raw=False)),
+        ('msgpack+gzip',
+         lambda data: gzip.compress(msgpack_renderer.render(data), 6),
+         lambda content: msgpack.unpackb(gzip.decompress(content), raw=False))
+    ]
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    page = {'count': None,
+            'next': 'http://localhost:8080/tasks?cursor=WyJpZCIsIG51bGwsIDMzNywgZmFsc2Vd',
+            'previous': None,
+            'results': [encoders.encode_task_row(row) for row in task_rows(100)]}
+    pull = [encoders.encode_task_row(row) for row in task_rows(10)]
+
+    print('{:<14} {:<12} {:>10} {:>12} {:>12}'.format('payload', 'format', 'bytes', 'encode us', 'decode us'))
+    for payload_name, data in [('100 task page', page), ('10 task pull', pull)]:
+        for format_name, encode, decode in formats():
+            content = encode(data)
+            encode_seconds = min(timeit.repeat(lambda: encode(data), number=iterations, repeat=3)) / iterations
+            decode_seconds = min(timeit.repeat(lambda: decode(content), number=iterations, repeat=3)) / iterations
+            print('{:<14} {:<12} {:>10} {:>12.1f} {:>12.1f}'.format(payload_name, format_name, len(content),
+                                                                   encode_seconds * 1000000,
+                                                                   decode_seconds * 1000000))
@@ -0,0 +1,81 @@
+"""How long tasks of small queues wait behind a flood of another task def, with
+oldest first and fair pulls. Seeds a backlog of classifier searches, then
+pulls in a loop while queueing one task for each of two small task defs
+before every pull. Runs against the configured database, which must be
+migrated, and deletes its tasks afterwards.
+
+    DB_HOST=localhost python -m benchmarks.fairness [pulls] [flood]
+
+Waits are from a task's run_at to the end of the pull that issued it, so only
+tasks that were served count, `served` shows how many of `queued` that was.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'task_service.settings')
+
+import django
+django.setup()
+
+from django.db import connection
+
+from api import queue
+from api.models import TaskDef, Task
+
+FLOOD = 'fairness-classifier-search'
+MINORITY = ['fairness-geneset-status-email', 'fairness-cleanup']
+
+def cleanup():
+    Task.objects.filter(task_def__name__in=[FLOOD] + MINORITY).delete()
+    TaskDef.objects.filter(name__in=[FLOOD] + MINORITY).delete()
+
+def run(pulls, flood, fair):
+    cleanup()
+    for name in [FLOOD] + MINORITY:
+        TaskDef.objects.create(name=name)
+
+    run_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    for start in range(0, flood, 1000):
+        queue.enqueue_tasks([{'task_def': FLOOD, 'run_at': run_at} for i in range(start, min(flood, start + 1000))])
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM ANALYZE tasks')
+
+    waits = []
+    queued = 0
+    pull_seconds = 0
+    for i in range(pulls):
+        queue.enqueue_tasks([{'task_def': name} for name in MINORITY])
+        queued += len(MINORITY)
+
+        start = time.perf_counter()
+        tasks = queue.get_tasks([FLOOD] + MINORITY, 'fairness-worker', 10, columns=['run_at'], fair=fair)
+        pull_seconds += time.perf_counter() - start
+        now = datetime.now(timezone.utc)
+        waits += [(now - task['run_at']).total_seconds() for task in tasks if task['task_def_name'] != FLOOD]
+
+    waits.sort()
+    return queued, waits, pull_seconds / pulls
+
+def milliseconds(waits, fraction):
+    if not waits:
+        return '-'
+    return '{:.1f}'.format(waits[min(len(waits) - 1, int(len(waits) * fraction))] * 1000)
+
+if __name__ == '__main__':
+    pulls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    flood = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    print('{:<8} {:>8} {:>8} {:>10} {:>10} {:>10} {:>12}'.format('pull', 'queued', 'served', 'p50 ms', 'p99 ms',
+                                                                'max ms', 'pull mean ms'))
+    try:
+        for name, fair in [('oldest', False), ('fair', True)]:
+            queued, waits, pull_mean = run(pulls, flood, fair)
+            print('{:<8} {:>8} {:>8} {:>10} {:>10} {:>10} {:>12.2f}'.format(name, queued, len(waits),
+                                                                       milliseconds(waits, 0.5),
+                                                                       milliseconds(waits, 0.99),
+                                                                       milliseconds(waits, 1),
+                                                                       pull_mean * 1000))
+    finally:
+        cleanup()
@@ -0,0 +1,74 @@
+"""Latency of a queue pull with the query sent as text, and prepared once per
+connection. Runs against the configured database, which must be migrated. The
+tasks it queues are deleted afterwards.
+
+    DB_HOST=localhost python -m benchmarks.pull [iterations]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'task_service.settings')
+
+import django
+django.setup()
+
+from django.db import connection
+from django.test import override_settings
+
+from api import queue
+from api.models import TaskDef, Task
+
+TASK_DEF = 'benchmark-pull'
+
+def seed(count):
+    run_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    for start in range(0, count, 1000):
+        queue.enqueue_tasks([{'task_def': TASK_DEF, 'run_at': run_at, 'data': {'n': n}}
+                             for n in range(start, min(count, start + 1000))])
+
+def time_pull(limit, columns, prepared):
+    with override_settings(PREPARED_STATEMENTS=prepared):
+        start = time.perf_counter()
+        tasks = queue.pull_tasks([TASK_DEF], 'benchmark-worker', limit, columns)
+        elapsed = time.perf_counter() - start
+
+    assert len(tasks) == limit
+    return elapsed
+
+def summary(timings):
+    timings = sorted(timings)
+    return (sum(timings) / len(timings) * 1000000,
+            timings[len(timings) // 2] * 1000000,
+            timings[int(len(timings) * 0.99)] * 1000000)
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    cases = [('1 task', 1, None), ('10 tasks', 10, None), ('10 tasks, id', 10, ['id'])]
+
+    TaskDef.objects.get_or_create(name=TASK_DEF)
+    Task.objects.filter(task_def_id=TASK_DEF).delete()
+    try:
+        seed(sum(limit for _, limit, _ in cases) * (iterations + 10) * 2)
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM ANALYZE tasks')
+
+        print('{:<14} {:<10} {:>10} {:>10} {:>10}'.format('pull', 'query', 'mean us', 'p50 us', 'p99 us'))
+        for case_name, limit, columns in cases:
+            ## warm up, the first prepared pull also sends the PREPARE
+            for _ in range(10):
+                time_pull(limit, columns, False)
+                time_pull(limit, columns, True)
+
+            ## alternate, so both see the same table as pulled tasks pile up
+            timings = {False: [], True: []}
+            for _ in range(iterations):
+                for prepared in (False, True):
+                    timings[prepared].append(time_pull(limit, columns, prepared))
+
+            for query, prepared in [('text', False), ('prepared', True)]:
+                print('{:<14} {:<10} {:>10.1f} {:>10.1f} {:>10.1f}'.format(case_name, query, *summary(timings[prepared])))
+    finally:
+        Task.objects.filter(task_def_id=TASK_DEF).delete()
+        TaskDef.objects.filter(name=TASK_DEF).delete()
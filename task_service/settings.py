@@ -30,10 +30,21 @@ ALLOWED_HOSTS = [os.getenv('DJANGO_HOST', '*')]
 
 REST_FRAMEWORK = {
     'UNAUTHENTICATED_USER': None,
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
     'PAGE_SIZE': 100,
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'api.auth.CognomaAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'api.renderers.MessagePackRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'api.parsers.MessagePackParser',
     )
 }
 
@@ -48,8 +59,33 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'api.middleware.RequestTimingMiddleware',
+    'api.middleware.ThresholdGZipMiddleware',
 ]
 
+# Server-Timing header and a log line for REQUEST_TIMING_SAMPLE_RATE of requests
+REQUEST_TIMING = os.getenv('REQUEST_TIMING', 'false') == 'true'
+REQUEST_TIMING_SAMPLE_RATE = float(os.getenv('REQUEST_TIMING_SAMPLE_RATE', 1.0))
+
+# smallest response worth gzipping, in bytes
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', 1024))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 ROOT_URLCONF = 'task_service.urls'
 
 WSGI_APPLICATION = 'task_service.wsgi.application'
@@ -67,10 +103,16 @@ DATABASES = {
         'USER': os.getenv('DB_USER', 'postgres'),
         'PASSWORD': os.getenv('DB_PASSWORD', 'postgres'),
         'HOST': os.getenv('DB_HOST', 'task_db'),
-        'PORT': os.getenv('DB_PORT', '5432')
+        'PORT': os.getenv('DB_PORT', '5432'),
+        # seconds a connection is kept for later requests, 0 closes it after each one
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60))
     }
 }
 
+# queue queries are prepared once per connection, turn off behind a pooler that
+# shares server sessions between transactions (pgbouncer's transaction mode)
+PREPARED_STATEMENTS = os.getenv('PREPARED_STATEMENTS', 'true') == 'true'
+
 dev_pub_key = """
 -----BEGIN PUBLIC KEY-----
 MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA5knVYXDKNZAZ36TAo2S2
@@ -85,6 +127,24 @@ AeN+7bMBi4PfTr4Y4VN/93OBckj4Dfe6AEtq31Z5Urh/e/+zaixbsmenAR1hvC6Z
 # SECURITY WARNING: change this to the prod public key!!
 JWT_PUB_KEY = os.getenv('JWT_PUB_KEY', dev_pub_key)
 
+# verified tokens are cached, so RS256 is only checked once per token per TTL
+JWT_CACHE_SIZE = int(os.getenv('JWT_CACHE_SIZE', 1024))
+JWT_CACHE_TTL = int(os.getenv('JWT_CACHE_TTL', 300)) # seconds, capped by the token's `exp`
+
+# task defs are cached per process, and dropped when any process changes one
+TASK_DEF_CACHE = os.getenv('TASK_DEF_CACHE', 'true') == 'true'
+
+# tasks queued with a run_at further ahead than this, in seconds, are `scheduled`
+# and kept out of the ready index, the queue maintainer makes them `queued` this
+# far ahead of their run_at. Keep it well above the maintainer's --interval.
+SCHEDULED_TASK_HORIZON = int(os.getenv('SCHEDULED_TASK_HORIZON', 60))
+
+TEST_RUNNER = 'api.test.runner.TestRunner'
+
+# task data larger than this, as compact JSON, is stored compressed in task_payloads
+# and fetched from /tasks/<id>/data instead of being returned with the task
+TASK_DATA_OFFLOAD_BYTES = int(os.getenv('TASK_DATA_OFFLOAD_BYTES', 65536))
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
 
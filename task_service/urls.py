@@ -9,8 +9,16 @@ urlpatterns = [
     url(r'^task-defs/(?P<name>[a-z0-9\-_]+)$', views.TaskDefRetrieveUpdate.as_view()),
     url(r'^tasks/?$', views.TaskList.as_view()),
     url(r'^tasks/(?P<id>[0-9]+)$', views.TaskRetrieveUpdate.as_view()),
+    url(r'^tasks/(?P<id>[0-9]+)/data$', views.TaskData.as_view()),
+    url(r'^tasks/bulk$', views.BulkTaskCreate.as_view()),
     url(r'^tasks/queue$', views.PullQueue.as_view()),
+    url(r'^tasks/ack$', views.AckTasks.as_view()),
     url(r'^tasks/(?P<id>[0-9]+)/touch$', views.TouchTask.as_view()),
     url(r'^tasks/(?P<id>[0-9]+)/release$', views.ReleaseTask.as_view()),
-    url(r'^tasks/(?P<id>[0-9]+)/dequeue$', views.DequeueTask.as_view())
+    url(r'^tasks/(?P<id>[0-9]+)/dequeue$', views.DequeueTask.as_view()),
+    url(r'^workers/(?P<worker_id>[^/]+)/touch$', views.TouchWorkerTasks.as_view()),
+    url(r'^schedules/?$', views.ScheduleList.as_view()),
+    url(r'^schedules/(?P<id>[0-9]+)$', views.ScheduleRetrieveUpdateDestroy.as_view()),
+    url(r'^stats/queues$', views.QueueStats.as_view()),
+    url(r'^metrics$', views.prometheus_metrics)
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)